@@ -3,6 +3,7 @@ from .models import *
 
 admin.site.register(Profile)
 admin.site.register(Committer)
+admin.site.register(CommitterAlias)
 admin.site.register(ProjectGroup)
 admin.site.register(Project)
 admin.site.register(Repository)
@@ -21,3 +22,7 @@ admin.site.register(Feedback)
 admin.site.register(Process)
 admin.site.register(ProjectAssessment)
 admin.site.register(ProjectGroupInvitation)
+admin.site.register(GitlabResponseCache)
+admin.site.register(SyncRun)
+admin.site.register(SyncPhase)
+admin.site.register(GroupSyncToken)
@@ -0,0 +1,187 @@
+import csv
+import hashlib
+import io
+import json
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import User, Milestone, Issue, Commit
+
+
+issue_update_fields = ["gitlab_iid", "title", "milestone", "repository", "has_been_moved", "gitlab_link", "closed_by", "author", "assignee", "gitlab_total_time_spent", "content_hash"]
+milestone_update_fields = ["title", "gitlab_link", "content_hash"]
+
+
+def content_hash(values):
+    return hashlib.sha1(json.dumps(values, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def milestone_hash(milestone):
+    return content_hash({"title": milestone["title"], "gitlab_link": milestone.get("web_url")})
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def batched(pages, size):
+    # Joins numbered pages until a batch has at least size items, so large first imports can still be written in one go.
+    # Every batch comes with the number of its last page
+    batch = []
+    last_page = None
+    for page, items in pages:
+        batch += items
+        last_page = page
+        if len(batch) >= size:
+            yield last_page, batch
+            batch = []
+    if len(batch) > 0:
+        yield last_page, batch
+
+
+def index_by(objects, key):
+    index = {}
+    for obj in objects:
+        index.setdefault(getattr(obj, key), obj)
+    return index
+
+
+def create_milestone_from_issue(repo, milestone):
+    # Issues can be synced before their milestone, e.g. by a group sync, GitLab embeds the whole milestone in them
+    owner = {"project": repo.project} if milestone.get("group_id") is not None else {"repository": repo}
+    return Milestone.objects.create(title=milestone["title"], gitlab_id=milestone["id"], gitlab_link=milestone.get("web_url"), content_hash=milestone_hash(milestone), **owner)
+
+
+def ingest_issues(repo, issues, metrics=None):
+    issue_index = index_by(Issue.objects.filter(gitlab_id__in=[issue["id"] for issue in issues]).order_by("pk"), "gitlab_id")
+    milestone_ids = [issue["milestone"]["id"] for issue in issues if issue["milestone"] is not None]
+    milestone_index = index_by(Milestone.objects.filter(gitlab_id__in=milestone_ids).order_by("pk"), "gitlab_id")
+    for issue in issues:
+        milestone = issue["milestone"]
+        if milestone is not None and milestone["id"] not in milestone_index and "title" in milestone:
+            milestone_index[milestone["id"]] = create_milestone_from_issue(repo, milestone)
+    usernames = set()
+    for issue in issues:
+        for field in ["closed_by", "author", "assignee"]:
+            if issue[field] is not None:
+                usernames.add(issue[field]["username"])
+    user_index = index_by(User.objects.filter(username__in=usernames), "username")
+
+    issues_to_refresh = []
+    new_issues = []
+    changed_issues = {}
+    unchanged = 0
+    for issue in issues:
+        gitlab_id = issue['id']
+        gitlab_iid = issue['iid']
+        total_time_spent = issue["time_stats"]["total_time_spent"] if issue.get("time_stats") is not None else None
+
+        # Only the fields present in the payload are written, partial payloads from hooks leave the rest as they are
+        values = {"gitlab_iid": gitlab_iid, "repository": repo.pk}
+        if issue['milestone'] is not None:
+            milestone_object = milestone_index.get(issue['milestone']['id'])
+            values["milestone"] = milestone_object.pk if milestone_object is not None else None
+        if issue['title'] is not None:
+            values["title"] = issue['title']
+        if issue["web_url"] is not None:
+            values["gitlab_link"] = issue["web_url"]
+        for field in ["closed_by", "author", "assignee"]:
+            if issue[field] is not None:
+                user = user_index.get(issue[field]["username"])
+                values[field] = user.pk if user is not None else None
+        if total_time_spent is not None:
+            values["gitlab_total_time_spent"] = total_time_spent
+        digest = content_hash(values)
+
+        issue_object = issue_index.get(gitlab_id)
+        if total_time_spent is None or issue_object is None or issue_object.total_time_spent != total_time_spent:
+            issues_to_refresh.append((gitlab_iid, gitlab_id, total_time_spent))
+        if issue_object is None:
+            issue_object = Issue(gitlab_id=gitlab_id, gitlab_iid=gitlab_iid)
+            issue_index[gitlab_id] = issue_object
+            new_issues.append(issue_object)
+        elif issue_object.content_hash == digest:
+            unchanged += 1
+            continue
+        elif issue_object.pk is not None:
+            changed_issues[issue_object.pk] = issue_object
+
+        if "milestone" in values:
+            if issue_object.milestone_id != values["milestone"]:
+                issue_object.has_been_moved = True
+            issue_object.milestone_id = values["milestone"]
+        issue_object.gitlab_iid = gitlab_iid
+        issue_object.title = values.get("title", issue_object.title)
+        issue_object.gitlab_link = values.get("gitlab_link", issue_object.gitlab_link)
+        issue_object.repository = repo
+        issue_object.closed_by_id = values.get("closed_by", issue_object.closed_by_id)
+        issue_object.author_id = values.get("author", issue_object.author_id)
+        issue_object.assignee_id = values.get("assignee", issue_object.assignee_id)
+        issue_object.gitlab_total_time_spent = values.get("gitlab_total_time_spent", issue_object.gitlab_total_time_spent)
+        issue_object.content_hash = digest
+
+    with transaction.atomic():
+        Issue.objects.bulk_create(new_issues, batch_size=500)
+        Issue.objects.bulk_update(list(changed_issues.values()), issue_update_fields, batch_size=500)
+    if metrics is not None:
+        metrics.add_rows(inserted=len(new_issues), updated=len(changed_issues), unchanged=unchanged)
+    return issues_to_refresh
+
+
+def get_new_commits(repo, commits):
+    candidates = {}
+    for commit in commits:
+        candidates.setdefault(commit["id"], commit)
+    # Commits are unique by hash over all repositories, so forks don't count the same work twice
+    for hashes in chunks(list(candidates.keys()), 1000):
+        for known_hash in Commit.objects.filter(hash__in=hashes).values_list("hash", flat=True):
+            candidates.pop(known_hash, None)
+    return list(candidates.values())
+
+
+def copy_commits(commit_objects):
+    fields = ["hash", "time", "message", "lines_added", "lines_removed", "author", "repository", "counted_in_user_project_total"]
+    columns = [Commit._meta.get_field(field).column for field in fields]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for commit in commit_objects:
+        writer.writerow([commit.hash, commit.time, commit.message, commit.lines_added, commit.lines_removed, commit.author_id, commit.repository_id, commit.counted_in_user_project_total])
+    buffer.seek(0)
+    # CSV COPY reads an unquoted empty field as NULL, an empty commit message has to stay an empty string
+    message_column = Commit._meta.get_field("message").column
+    column_list = ", ".join(connection.ops.quote_name(column) for column in columns)
+    with connection.cursor() as cursor:
+        # COPY can't skip conflicts, so commits another repository stored in the meantime are left out when moving them over
+        cursor.execute(f"CREATE TEMPORARY TABLE commit_copy AS SELECT {column_list} FROM {Commit._meta.db_table} WITH NO DATA")
+        cursor.copy_expert(f"COPY commit_copy ({column_list}) FROM STDIN WITH (FORMAT csv, FORCE_NOT_NULL ({connection.ops.quote_name(message_column)}))", buffer)
+        cursor.execute(f"INSERT INTO {Commit._meta.db_table} ({column_list}) SELECT {column_list} FROM commit_copy ON CONFLICT ({connection.ops.quote_name(Commit._meta.get_field('hash').column)}) DO NOTHING")
+        cursor.execute("DROP TABLE commit_copy")
+
+
+def ingest_commits(repo, commits, committer_resolver, first_import=None):
+    new_commits = get_new_commits(repo, commits)
+    if len(new_commits) == 0:
+        return 0
+    if first_import is None:
+        first_import = not Commit.objects.filter(repository=repo).exists()
+    with transaction.atomic():
+        committer_index = committer_resolver.resolve(set((commit["committer_name"], commit["committer_email"]) for commit in new_commits))
+        commit_objects = []
+        for commit in new_commits:
+            commit_objects.append(Commit(
+                hash=commit["id"],
+                time=commit["created_at"],
+                message=commit["message"],
+                lines_added=commit["stats"]["additions"],
+                lines_removed=commit["stats"]["deletions"],
+                author=committer_index[(commit["committer_name"], commit["committer_email"])],
+                repository=repo
+            ))
+        if first_import and len(commit_objects) >= settings.COMMIT_COPY_THRESHOLD and connection.vendor == "postgresql":
+            copy_commits(commit_objects)
+        else:
+            # Forks synced in parallel can both find a shared commit missing, the hash is unique so only one of them stores it
+            Commit.objects.bulk_create(commit_objects, batch_size=1000, ignore_conflicts=True)
+    return len(commit_objects)
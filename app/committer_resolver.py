@@ -0,0 +1,47 @@
+import threading
+
+from django.db import transaction
+from django.db.models import Case, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Left, StrIndex
+
+from .models import User, Committer, CommitterAlias
+
+
+class CommitterResolver:
+    def __init__(self):
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def resolve(self, identities):
+        new_committers = {}
+        with self.lock:
+            missing = set(identity for identity in identities if identity not in self.cache)
+            if len(missing) > 0:
+                names = set(name for name, _ in missing)
+                emails = set(email for _, email in missing)
+                for committer in Committer.objects.filter(name__in=names).filter(email__in=emails).order_by("pk"):
+                    identity = (committer.name, committer.email)
+                    if identity in missing and identity not in self.cache:
+                        self.cache[identity] = committer
+                new_committers = {(name, email): Committer(name=name, email=email) for name, email in missing if (name, email) not in self.cache}
+                Committer.objects.bulk_create(list(new_committers.values()), batch_size=500)
+            resolved = {identity: new_committers.get(identity, self.cache.get(identity)) for identity in identities}
+        # Shared by the repositories of a group sync, so new rows are only cached once the caller's transaction keeps them
+        if len(new_committers) > 0:
+            transaction.on_commit(lambda: self.add(new_committers))
+        return resolved
+
+    def add(self, committers):
+        with self.lock:
+            for identity, committer in committers.items():
+                self.cache.setdefault(identity, committer)
+
+
+def link_unlinked_committers():
+    email_alias = CommitterAlias.objects.filter(kind=CommitterAlias.AliasKind.EMAIL).filter(alias=OuterRef("email")).values("account")[:1]
+    name_alias = CommitterAlias.objects.filter(kind=CommitterAlias.AliasKind.NAME).filter(alias=OuterRef("name")).values("account")[:1]
+    email_username = User.objects.filter(username=Left(OuterRef("email"), StrIndex(OuterRef("email"), Value("@")) - 1)).values("pk")[:1]
+    name_username = User.objects.filter(username=OuterRef("name")).values("pk")[:1]
+    return Committer.objects.filter(account__isnull=True).update(account=Coalesce(
+        Subquery(email_alias), Subquery(name_alias), Case(When(email__contains="@", then=Subquery(email_username))), Subquery(name_username)
+    ))
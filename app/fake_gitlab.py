@@ -0,0 +1,223 @@
+import datetime
+import hashlib
+import itertools
+import json
+import re
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+base_time = datetime.datetime(2022, 2, 1, tzinfo=datetime.timezone.utc)
+
+
+def timestamp(minutes):
+    return (base_time + datetime.timedelta(minutes=minutes)).isoformat().replace("+00:00", "Z")
+
+
+def parse_time(value):
+    parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=datetime.timezone.utc)
+
+
+class FakeGitlabData:
+    def __init__(self, group_id=1, projects=10, members=5, milestones=4, issues=100, notes=4, commits=300, base_url="http://localhost"):
+        self.group_id = group_id
+        self.base_url = base_url
+        self.ids = itertools.count(1)
+        self.group_milestones = [self.milestone(i, "group", group_id=group_id) for i in range(milestones)]
+        self.projects = {}
+        for p in range(projects):
+            project_id = 1000 + p
+            usernames = [f"student{p}.member{m}" for m in range(members)]
+            project = {
+                "id": project_id,
+                "name": f"project-{p}",
+                "name_with_namespace": f"Fake group / project-{p}",
+                "web_url": f"{base_url}/fake/project-{p}",
+                "namespace": {"id": group_id, "kind": "group"},
+                "default_branch": "main",
+                "last_activity_at": timestamp(commits + issues)
+            }
+            project_milestones = [self.milestone(i, f"project-{p}", project_id=project_id) for i in range(milestones)]
+            self.projects[project_id] = {
+                "project": project,
+                "members": [{"id": next(self.ids), "username": username, "access_level": 30} for username in usernames],
+                "milestones": project_milestones,
+                "issues": [self.issue(project_id, iid, usernames, project_milestones, notes) for iid in range(1, issues + 1)],
+                "notes": notes,
+                "commits": [self.commit(project_id, i, usernames) for i in range(commits)]
+            }
+
+    def milestone(self, number, owner, **owner_id):
+        return {"id": next(self.ids), "iid": number + 1, "title": f"Milestone {number + 1}", "web_url": f"{self.base_url}/{owner}/milestones/{number + 1}", **owner_id}
+
+    def issue(self, project_id, iid, usernames, milestones, notes):
+        author = {"username": usernames[iid % len(usernames)]}
+        milestone = milestones[iid % len(milestones)] if len(milestones) > 0 else None
+        return {
+            "id": next(self.ids),
+            "iid": iid,
+            "project_id": project_id,
+            "title": f"Issue {iid}",
+            "milestone": milestone,
+            "web_url": f"{self.base_url}/project-{project_id}/issues/{iid}",
+            "closed_by": None,
+            "author": author,
+            "assignee": author,
+            "updated_at": timestamp(iid),
+            "time_stats": {"total_time_spent": (notes + 1) // 2 * 5400}
+        }
+
+    def notes_for(self, project_id, iid):
+        project = self.projects[project_id]
+        issue_id = project["issues"][iid - 1]["id"]
+        author = project["members"][iid % len(project["members"])]["username"]
+        notes = []
+        for n in range(project["notes"]):
+            body = "added 1h 30m of time spent" if n % 2 == 0 else f"Comment {n}"
+            notes.append({"id": issue_id * 1000 + n, "body": body, "author": {"username": author}, "created_at": timestamp(iid + n), "system": n % 2 == 0})
+        return notes
+
+    def commit(self, project_id, number, usernames):
+        username = usernames[number % len(usernames)]
+        return {
+            "id": hashlib.sha1(f"{project_id}-{number}".encode()).hexdigest(),
+            "created_at": timestamp(number),
+            "committed_date": timestamp(number),
+            "message": f"Commit {number}",
+            "committer_name": username,
+            "committer_email": f"{username}@ttu.ee",
+            "stats": {"additions": number % 50, "deletions": number % 7, "total": number % 50 + number % 7}
+        }
+
+
+class FakeGitlabServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, data, latency=0, max_per_page=100):
+        super().__init__(address, FakeGitlabHandler)
+        self.data = data
+        self.latency = latency
+        self.max_per_page = max_per_page
+        self.request_count = 0
+        self.bytes_sent = 0
+        self.count_lock = threading.Lock()
+
+    def start_in_background(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+
+class FakeGitlabHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        with self.server.count_lock:
+            self.server.request_count += 1
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        parsed = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        try:
+            result = self.route(parsed.path, query)
+        except KeyError:
+            result = None
+        if result is None:
+            self.send_json({"message": "404 Not Found"}, status=404)
+            return
+        body, paginate, with_totals = result
+        if paginate:
+            self.send_page(body, query, with_totals)
+        else:
+            self.send_json(body)
+
+    def route(self, path, query):
+        data = self.server.data
+        match = re.fullmatch(r"/api/v4/groups/(\d+)/(projects|milestones|issues)", path)
+        if match:
+            if match.group(2) == "projects":
+                return [project["project"] for project in data.projects.values()], True, True
+            if match.group(2) == "issues":
+                return self.filter_issues([issue for project in data.projects.values() for issue in project["issues"]], query), True, True
+            return data.group_milestones, True, True
+        match = re.fullmatch(r"/api/v4/projects/(\d+)(/.*)?", path)
+        if not match:
+            return None
+        project = data.projects[int(match.group(1))]
+        rest = match.group(2) or ""
+        if rest == "":
+            return project["project"], False, False
+        if rest in ["/members", "/members/all"]:
+            return project["members"], True, True
+        if rest == "/milestones":
+            return project["milestones"], True, True
+        if rest == "/issues":
+            return self.filter_issues(project["issues"], query), True, True
+        match = re.fullmatch(r"/issues/(\d+)/notes", rest)
+        if match:
+            return data.notes_for(project["project"]["id"], int(match.group(1))), True, True
+        if rest == "/repository/commits":
+            commits = self.filter_commits(list(reversed(project["commits"])), query.get("ref_name"))
+            if "since" in query:
+                commits = [commit for commit in commits if parse_time(commit["committed_date"]) >= parse_time(query["since"])]
+            # Like GitLab, commit listings don't report totals
+            return commits, True, False
+        match = re.fullmatch(r"/repository/commits/(\w+)", rest)
+        if match:
+            return next(commit for commit in project["commits"] if commit["id"] == match.group(1)), False, False
+        return None
+
+    def filter_issues(self, issues, query):
+        # Like GitLab, updated_after includes issues updated at exactly that time
+        if "updated_after" in query:
+            issues = [issue for issue in issues if parse_time(issue["updated_at"]) >= parse_time(query["updated_after"])]
+        if query.get("order_by") == "updated_at":
+            issues = sorted(issues, key=lambda issue: (parse_time(issue["updated_at"]), issue["id"]), reverse=query.get("sort", "desc") == "desc")
+        return issues
+
+    def filter_commits(self, commits, ref_name):
+        # The history is linear and listed newest first, a range only keeps the commits after its start
+        if ref_name is None:
+            return commits
+        start, _, end = ref_name.rpartition("..")
+        ids = [commit["id"] for commit in commits]
+        if end not in ids or (start != "" and start not in ids):
+            raise KeyError(ref_name)
+        commits = commits[ids.index(end):]
+        return commits[:max(0, ids.index(start) - ids.index(end))] if start != "" else commits
+
+    def send_page(self, items, query, with_totals):
+        per_page = min(int(query.get("per_page", 20)), self.server.max_per_page)
+        page = int(query.get("page", 1))
+        total_pages = max(1, -(-len(items) // per_page))
+        headers = {"X-Page": str(page), "X-Per-Page": str(per_page), "X-Next-Page": str(page + 1) if page < total_pages else ""}
+        if with_totals:
+            headers["X-Total"] = str(len(items))
+            headers["X-Total-Pages"] = str(total_pages)
+        self.send_json(items[(page - 1) * per_page:page * per_page], headers=headers)
+
+    def send_json(self, body, status=200, headers=None):
+        content = json.dumps(body).encode()
+        etag = f'W/"{hashlib.md5(content).hexdigest()}"'
+        if status == 200 and self.headers.get("If-None-Match") == etag:
+            status = 304
+            content = b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", etag)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+        with self.server.count_lock:
+            self.server.bytes_sent += len(content)
@@ -0,0 +1,381 @@
+import itertools
+import queue
+import threading
+import time
+
+import requests
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import GitlabResponseCache
+
+
+session_lock = threading.Lock()
+shared_session = None
+
+
+def get_session():
+    # One session for the whole process, so keep-alive connections are reused between syncs
+    global shared_session
+    with session_lock:
+        if shared_session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.GITLAB_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update({"Accept-Encoding": "gzip", "Accept": "application/json"})
+            shared_session = session
+        return shared_session
+
+
+class GitlabError(Exception):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class AdaptiveLimiter:
+    # Shared by every request made with the same token, since GitLab rate limits per user
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self.successes = 0
+        self.paused_until = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        paused = 0
+        with self.condition:
+            while True:
+                pause = self.paused_until - time.time()
+                if pause > 0:
+                    start = time.time()
+                    self.condition.wait(pause)
+                    paused += time.time() - start
+                elif self.active < self.limit:
+                    self.active += 1
+                    return paused
+                else:
+                    self.condition.wait()
+
+    def release(self, throttled):
+        with self.condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    def pause(self, seconds):
+        with self.condition:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+            self.condition.notify_all()
+
+    def is_paused(self):
+        with self.condition:
+            return self.paused_until > time.time()
+
+
+limiters_lock = threading.Lock()
+limiters = {}
+
+
+def get_limiter(token):
+    with limiters_lock:
+        if token not in limiters:
+            limiters[token] = AdaptiveLimiter(settings.GITLAB_MAX_CONCURRENCY)
+        return limiters[token]
+
+
+leases_lock = threading.Lock()
+leases = {}  # Syncs of this process currently using each token
+
+
+class TokenPool:
+    # GitLab rate limits every token on its own, so parallel syncs are spread over all the tokens a project group has
+    def __init__(self, tokens):
+        self.tokens = list(dict.fromkeys(tokens))
+        self.turns = itertools.count()
+
+    def load(self, token):
+        limiter = get_limiter(token)
+        # A paused token goes last and a throttled one takes fewer syncs, since its concurrency limit was lowered
+        return limiter.is_paused(), leases.get(token, 0) / limiter.limit
+
+    def choose(self):
+        start = next(self.turns) % len(self.tokens)
+        # Ties go round-robin, so idle tokens all get used
+        return min(self.tokens[start:] + self.tokens[:start], key=self.load)
+
+    def pick(self):
+        with leases_lock:
+            return self.choose()
+
+    @contextmanager
+    def lease(self):
+        with leases_lock:
+            token = self.choose()
+            leases[token] = leases.get(token, 0) + 1
+        try:
+            yield token
+        finally:
+            with leases_lock:
+                leases[token] -= 1
+
+
+def is_retryable(response):
+    return response is None or response.status_code == 429 or response.status_code >= 500
+
+
+def is_near_rate_limit(response):
+    if response is None:
+        return False
+    remaining = response.headers.get("RateLimit-Remaining")
+    limit = response.headers.get("RateLimit-Limit")
+    if remaining is None or limit is None:
+        return False
+    return int(remaining) <= int(limit) * settings.GITLAB_RATE_LIMIT_SLOWDOWN_FRACTION
+
+
+def get_retry_delay(response, attempt):
+    if response is not None:
+        if response.headers.get("Retry-After", "").isdigit():
+            return int(response.headers["Retry-After"])
+        # GitLab sends the reset time with every response, it only says how long to wait once the limit is hit
+        if response.status_code == 429 and response.headers.get("RateLimit-Reset", "").isdigit():
+            return max(0, int(response.headers["RateLimit-Reset"]) - time.time())
+    return min(settings.GITLAB_BACKOFF_MAX, settings.GITLAB_BACKOFF_BASE * 2 ** (attempt - 1))
+
+
+class ConditionalResponse:
+    def __init__(self, url, data, not_modified, etag=None, last_modified=None):
+        self.url = url
+        self.data = data
+        self.not_modified = not_modified
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def store(self):
+        # Called once the data has been reconciled, so a failed sync doesn't leave a cache entry that skips it next time
+        if self.not_modified or (self.etag is None and self.last_modified is None):
+            return
+        GitlabResponseCache.objects.update_or_create(url=self.url, defaults={
+            "etag": self.etag,
+            "last_modified": self.last_modified,
+            "body": self.data,
+            "updated_at": timezone.now()
+        })
+
+
+class GitlabClient:
+    def __init__(self, token, base_url=None, timeout=None, per_page=100):
+        self.token = token
+        self.api_url = (base_url if base_url is not None else settings.GITLAB_URL) + "/api/v4"
+        self.timeout = timeout if timeout is not None else settings.GITLAB_REQUEST_TIMEOUT
+        self.per_page = per_page
+        self.session = get_session()
+        self.limiter = get_limiter(token)
+        self.stats_lock = threading.Lock()
+        self.request_count = 0
+        self.retry_count = 0
+        self.throttled_seconds = 0
+        self.bytes_received = 0
+
+    def add_stats(self, requests_made=0, retries=0, throttled_seconds=0, bytes_received=0):
+        with self.stats_lock:
+            self.request_count += requests_made
+            self.retry_count += retries
+            self.throttled_seconds += throttled_seconds
+            self.bytes_received += bytes_received
+
+    def request(self, endpoint, params=None, extra_headers=None):
+        headers = {} if self.token is None else {"PRIVATE-TOKEN": self.token}
+        headers.update(extra_headers or {})
+        attempt = 0
+        while True:
+            self.add_stats(throttled_seconds=self.limiter.acquire())
+            response = None
+            error = None
+            try:
+                response = self.session.get(self.api_url + endpoint, params=params, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            finally:
+                self.limiter.release(is_retryable(response) or is_near_rate_limit(response))
+            self.add_stats(requests_made=1, bytes_received=0 if response is None else len(response.content))
+            if not is_retryable(response):
+                if response.status_code >= 400:
+                    raise GitlabError(f"GitLab answered {response.status_code} for {endpoint}: {response.text[:500]}", response.status_code)
+                return response
+            attempt += 1
+            if attempt > settings.GITLAB_MAX_RETRIES:
+                reason = error if response is None else f"status {response.status_code}"
+                raise GitlabError(f"Giving up on {endpoint} after {attempt} attempts, last failure was {reason}", None if response is None else response.status_code)
+            delay = get_retry_delay(response, attempt)
+            print(f"GitLab request to {endpoint} failed ({error if response is None else response.status_code}), retrying in {delay:.1f}s")
+            self.add_stats(retries=1)
+            self.limiter.pause(delay)
+
+    def get(self, endpoint, params=None):
+        return self.request(endpoint, params).json()
+
+    def get_conditional(self, endpoint, params=None, scope=None):
+        # The scope separates cache entries when the same URL is reconciled into different places
+        url = requests.Request("GET", self.api_url + endpoint, params=params).prepare().url
+        if scope is not None:
+            url += f"#{scope}"
+        cached = GitlabResponseCache.objects.filter(url=url).first()
+        headers = {}
+        if cached is not None and cached.etag is not None:
+            headers["If-None-Match"] = cached.etag
+        if cached is not None and cached.last_modified is not None:
+            headers["If-Modified-Since"] = cached.last_modified
+        response = self.request(endpoint, params, headers)
+        if response.status_code == 304:
+            return ConditionalResponse(url, cached.body, True)
+        return ConditionalResponse(url, response.json(), False, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+    def get_all_pages_conditional(self, endpoint, params=None, scope=None):
+        page_params = dict(params or {})
+        page_params["per_page"] = self.per_page
+        page_params["page"] = 1
+        first = self.get_conditional(endpoint, page_params, scope)
+        if not isinstance(first.data, list) or len(first.data) < self.per_page:
+            return first
+        rest = self.get_pages_sequential(endpoint, 2, params)
+        # Only the first page is cached, so an unchanged first page doesn't mean the later ones are unchanged too
+        return ConditionalResponse(first.url, first.data + rest, False)
+
+    def get_page(self, endpoint, page, params=None):
+        page_params = dict(params or {})
+        page_params["per_page"] = self.per_page
+        page_params["page"] = page
+        return self.request(endpoint, page_params)
+
+    def get_all_pages(self, endpoint, params=None):
+        return [item for page in self.iter_pages(endpoint, params) for item in page]
+
+    def iter_pages(self, endpoint, params=None, start_page=1):
+        for _, answer in self.iter_numbered_pages(endpoint, params, start_page):
+            yield answer
+
+    def iter_numbered_pages(self, endpoint, params=None, start_page=1):
+        first = self.get_page(endpoint, start_page, params)
+        answer = first.json()
+        if not isinstance(answer, list):
+            print(f"Expected a list from {endpoint} page {start_page}, got {answer}")
+            return
+        yield start_page, answer
+        total_pages = first.headers.get("X-Total-Pages")
+        if total_pages:
+            yield from self.iter_pages_parallel(endpoint, start_page + 1, int(total_pages), params)
+        elif len(answer) >= self.per_page:
+            yield from self.iter_pages_sequential(endpoint, start_page + 1, params)
+
+    def iter_pages_parallel(self, endpoint, start, end, params=None):
+        # Pages are requested a window at a time, so only a window of pages is ever held in memory
+        window = max(1, settings.GITLAB_PAGE_FETCH_WORKERS)
+        with ThreadPoolExecutor(max_workers=window) as executor:
+            for window_start in range(start, end + 1, window):
+                pages = range(window_start, min(end, window_start + window - 1) + 1)
+                for page, answer in zip(pages, executor.map(lambda page: self.get_page(endpoint, page, params).json(), pages)):
+                    if not isinstance(answer, list):
+                        print(f"Expected a list from {endpoint} page {page}, got {answer}")
+                        continue
+                    yield page, answer
+
+    def iter_pages_sequential(self, endpoint, start, params=None):
+        page = start
+        while True:
+            answer = self.get_page(endpoint, page, params).json()
+            if not isinstance(answer, list):
+                print(f"Expected a list from {endpoint} page {page}, got {answer}")
+                return
+            yield page, answer
+            if len(answer) < self.per_page:
+                return
+            page += 1
+
+    def get_pages_sequential(self, endpoint, start, params=None):
+        return [item for _, page in self.iter_pages_sequential(endpoint, start, params) for item in page]
+
+    def iter_updated_pages(self, endpoint, cursor, params=None):
+        # GitLab has no keyset pagination for issues, so every page starts again from the last updated_at seen. Deep pages
+        # cost the same as the first one, and an issue updated mid-sync moves ahead of the cursor instead of shifting pages
+        while True:
+            page_params = dict(params or {})
+            page_params.update({"order_by": "updated_at", "sort": "asc", "updated_after": cursor["updated_after"]})
+            answer = self.get_page(endpoint, cursor["page"], page_params).json()
+            if not isinstance(answer, list):
+                print(f"Expected a list from {endpoint} after {cursor['updated_after']}, got {answer}")
+                return
+            seen = set(cursor["seen"])
+            items = [item for item in answer if item["id"] not in seen]
+            last = answer[-1]["updated_at"] if len(answer) > 0 else cursor["updated_after"]
+            if last != cursor["updated_after"]:
+                # updated_after includes its own timestamp, so the ones already seen with it are left out of the next page
+                cursor = {"updated_after": last, "page": 1, "seen": [item["id"] for item in answer if item["updated_at"] == last]}
+            else:
+                # A whole page with the same updated_at can't move the cursor, the next one is taken by offset
+                cursor = {"updated_after": last, "page": cursor["page"] + 1, "seen": cursor["seen"] + [item["id"] for item in items]}
+            yield cursor, items
+            if len(answer) < self.per_page:
+                return
+
+
+def updated_cursor(updated_after):
+    return {"updated_after": updated_after, "page": 1, "seen": []}
+
+
+def prefetch(pages, size=None):
+    # Fetches the next pages in a background thread while the caller writes the current one
+    size = size if size is not None else settings.GITLAB_PREFETCH_PAGES
+    buffer = queue.Queue(maxsize=max(1, size))
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for page in pages:
+                put(("page", page))
+                if stop.is_set():
+                    break
+            put(("done", None))
+        except Exception as e:
+            put(("error", e))
+        finally:
+            if hasattr(pages, "close"):
+                pages.close()
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, page = buffer.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise page
+            yield page
+    finally:
+        stop.set()
+        producer.join()
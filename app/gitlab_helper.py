@@ -1,55 +1,99 @@
-import requests
-import random
-import string
-import time
 import datetime
+import hashlib
+import threading
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.fernet import InvalidToken
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import User, Profile, Repository, UserProject, UserProjectGroup, Milestone, Issue, TimeSpent, Commit, GroupSyncToken, Process
 
-from .models import User, Profile, Repository, UserProject, Milestone, Issue, TimeSpent, Commit, Committer
+from .serializers import ProjectGroupSerializer
 
-from .serializers import RegisterSerializer, ProjectGroupSerializer
+from .gitlab_client import GitlabClient, GitlabError, TokenPool, prefetch, updated_cursor
+from .committer_resolver import CommitterResolver, link_unlinked_committers
+from .sync_checkpoint import Checkpoint
 
 from . import assessment_tree
+from . import bulk_ingest
 from . import helpers
+from . import security
+from . import sync_metrics
 
 
-def get_token(repo, user, user_token):
-    if repo.project.project_group.gitlab_token is not None:
-        return repo.project.project_group.gitlab_token
+def get_group_token(project_group, user_token):
+    if project_group.gitlab_token is not None:
+        return project_group.gitlab_token
     return user_token
 
 
-def get_members_from_repo(repo, user, get_all, user_token):
-    base_url = "https://gitlab.cs.ttu.ee"
-    api_part = "/api/v4"
+def get_token_pool(project_group, user_token):
+    tokens = [get_group_token(project_group, user_token)]
+    # Only admins that still are admins of the group lend their token
+    admins = UserProjectGroup.objects.filter(project_group=project_group).filter(rights__in=["A", "O"]).values("account")
+    for sync_token in GroupSyncToken.objects.filter(project_group=project_group).filter(account__in=admins).order_by("pk"):
+        try:
+            tokens.append(security.decrypt_for_server(sync_token.token))
+        except InvalidToken:
+            print(f"Sync token of user {sync_token.account_id} in project group {project_group.pk} can't be decrypted, skipping it")
+    # A group without its own token can still sync with lent ones, only without any token left the requests go unauthenticated
+    tokens = [token for token in tokens if token is not None]
+    return TokenPool(tokens if len(tokens) > 0 else [None])
+
+
+def get_token(repo, user, user_token):
+    return get_group_token(repo.project.project_group, user_token)
+
+
+def get_client(repo, user, user_token):
+    return GitlabClient(get_token(repo, user, user_token))
+
+
+def get_members_from_repo(repo, user, get_all, user_token, client=None):
+    if client is None:
+        client = get_client(repo, user, user_token)
     endpoint_part = f"/projects/{repo.gitlab_id}/members" + ("/all" if get_all else "")
-    token_part = f"?private_token={get_token(repo, user, user_token)}"
-    print(token_part)
-    answer = requests.get(base_url + api_part + endpoint_part + token_part)
-    return answer.json()
+    # Course groups have hundreds of inherited members, more than fit on one page
+    return client.get_all_pages(endpoint_part)
 
 
-def create_user(username, user_objects):
-    users = User.objects.filter(username=username)
-    if users.count() > 0:
-        user_objects.append(users.first())
-        return
-    email = username + "@ttu.ee"
-    sub_data = {}
-    sub_data["username"] = username
-    sub_data["email"] = email
-    sub_data["password"] = "".join([random.choice(string.ascii_lowercase) for _ in range(20)])
-    sub_data["password_confirm"] = sub_data["password"]
+def synthetic_user(username):
     if "." in username:
-        sub_data["first_name"] = username.split(".")[0]
-        sub_data["last_name"] = ".".join(username.split(".")[1:])
+        first_name = username.split(".")[0]
+        last_name = ".".join(username.split(".")[1:])
     else:
-        sub_data["first_name"] = username[:len(username) // 2]
-        sub_data["last_name"] = username[len(username) // 2:]
-    serializer = RegisterSerializer(data=sub_data)
-    serializer.is_valid()
-    user_object = serializer.save()
-    Profile.objects.create(user=user_object, actual_account=False)
-    user_objects.append(user_object)
+        first_name = username[:len(username) // 2]
+        last_name = username[len(username) // 2:]
+    user_object = User(username=username, email=username + "@ttu.ee", first_name=first_name, last_name=last_name)
+    # Placeholder accounts never log in, so skip hashing a random password for them
+    user_object.set_unusable_password()
+    return user_object
+
+
+def create_users(usernames):
+    usernames = list(dict.fromkeys(usernames))
+    existing = set(User.objects.filter(username__in=usernames).values_list("username", flat=True))
+    missing = [username for username in usernames if username not in existing]
+    if len(missing) > 0:
+        # Conflicts are ignored because parallel repository syncs can provision the same member at the same time
+        with transaction.atomic():
+            User.objects.bulk_create([synthetic_user(username) for username in missing], batch_size=500, ignore_conflicts=True)
+            created = User.objects.filter(username__in=missing).filter(profile__isnull=True).all()
+            Profile.objects.bulk_create([Profile(user=user_object, actual_account=False) for user_object in created], batch_size=500, ignore_conflicts=True)
+    user_index = {user_object.username: user_object for user_object in User.objects.filter(username__in=usernames).all()}
+    return [user_index[username] for username in usernames]
+
+
+def create_user(username, user_objects):
+    user_objects += create_users([username])
 
 
 available_times = {
@@ -93,23 +137,104 @@ def is_time_spent_message(message):
     return True, sum(parts)
 
 
-def update_all_repos_in_group(project_group, user, process, user_token):
+def save_time_spents(repo, time_spents, new_users):
+    logged = []
+    for id, note in time_spents:
+        is_time_spent, amount = is_time_spent_message(note['body'])
+        if is_time_spent:
+            logged.append((id, note, amount))
+    user_index = bulk_ingest.index_by(User.objects.filter(username__in=set(note['author']['username'] for _, note, _ in logged)), "username")
+    issue_index = bulk_ingest.index_by(Issue.objects.filter(gitlab_id__in=set(id for id, _, _ in logged)).order_by("pk"), "gitlab_id")
+    known_notes = set(TimeSpent.objects.filter(gitlab_id__in=[note['id'] for _, note, _ in logged]).values_list("gitlab_id", flat=True))
+    new_time_spents = []
+    for id, note, amount in logged:
+        author = note['author']['username']
+        if author not in user_index:
+            print(f"Error, unknown user {author} logged time, repo id {repo.gitlab_id}")
+            if author not in new_users:
+                new_users.append(author)
+            continue
+        if note['id'] in known_notes or id not in issue_index:
+            continue
+        known_notes.add(note['id'])
+        new_time_spents.append(TimeSpent(gitlab_id=note['id'], amount=amount, time=note['created_at'], issue=issue_index[id], user=user_index[author]))
+    # An issue hook can save the same note while a sync is reading it
+    TimeSpent.objects.bulk_create(new_time_spents, batch_size=500, ignore_conflicts=True)
+    return len(new_time_spents)
+
+
+def wait_for_interactive_syncs():
+    # Holds back the next repository of a group sync, so a repository refresh someone is waiting for gets the tokens and the database
+    deadline = time.monotonic() + settings.SYNC_YIELD_MAX_WAIT
+    interactive = Process.objects.filter(status="O").filter(priority=Process.SyncPriority.INTERACTIVE)
+    while time.monotonic() < deadline and interactive.exists():
+        time.sleep(settings.SYNC_YIELD_POLL_INTERVAL)
+
+
+def update_all_repos_in_group(project_group, user, process, user_token, full_commit_sync=False, workers=None, phases=None, force=False):
     print(f"Starting process with hash {process.hash}")
-    repos = []
+    repos_per_project = []
     new_users = []
+    failed_repos = []
+    committer_resolver = CommitterResolver()
+    checkpoint = Checkpoint(process)
+    token_pool = get_token_pool(project_group, user_token)
+    phases = phases if phases is not None else repository_phases
+    group_sync = GroupSync(project_group, token_pool, checkpoint, process, phases, force)
     for project in project_group.project_set.all():
-        for repository in project.repository_set.all():
-            repos.append(repository.pk)
-    for i, repo in enumerate(repos):
-        update_repository(repo, user, new_users, user_token)
-        process.completion_percentage = 100 * (i + 1) / len(repos)
-        process.save()
-        print(f"{100 * (i + 1) / len(repos)}% done refreshing repos")
+        repos_per_project.append([repository.pk for repository in project.repository_set.all()])
+    # Members come first when issues are fetched for the whole group, so the issue users exist when those are ingested
+    first_phases = [phase for phase in ["members", "milestones"] if phase in phases]
+    stages = [first_phases, phases] if group_sync.lists_issues and len(first_phases) > 0 else [phases]
+    step_count = len(stages) * sum(len(repos) for repos in repos_per_project)
+    progress_lock = threading.Lock()
+    done = 0
+
+    # Repositories of the same project share members, so those are refreshed one after another
+    def refresh_project_repos(repos, phases):
+        nonlocal done
+        try:
+            for repo in repos:
+                if process.priority != Process.SyncPriority.INTERACTIVE:
+                    wait_for_interactive_syncs()
+                try:
+                    repo_phases = phases if repo not in group_sync.inactive else [phase for phase in phases if phase not in activity_phases]
+                    update_repository(repo, user, new_users, user_token, full_commit_sync=full_commit_sync, committer_resolver=committer_resolver,
+                                      group_process=process, checkpoint=checkpoint, phases=repo_phases, token_pool=token_pool, skip_inactive=not force)
+                except Exception:
+                    print(f"Refreshing repo {repo} failed: {traceback.format_exc()}")
+                    if repo not in failed_repos: failed_repos.append(repo)
+                with progress_lock:
+                    done += 1
+                    process.completion_percentage = 100 * done / step_count
+                    process.save(update_fields=["completion_percentage", "status", "data"])
+                    print(f"{100 * done / step_count}% done refreshing repos")
+        finally:
+            connection.close()
+
+    workers = workers if workers is not None else settings.GROUP_SYNC_WORKERS
+    for stage, stage_phases in enumerate(stages):
+        if stage == len(stages) - 1:
+            group_sync.sync_issues()
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list(executor.map(lambda repos: refresh_project_repos(repos, stage_phases), repos_per_project))
+    # Repositories left out by the group activity check or by their own one
+    skipped_repos = sorted(group_sync.inactive | {repo for repos in repos_per_project for repo in repos if checkpoint.state(repo).get("inactive", False)})
+    # The last stage runs again whatever failed in the first one, only repositories that still miss phases failed
+    failed_repos = [repo for repo in failed_repos
+                    if not all(checkpoint.is_done(repo, phase) for phase in phases if repo not in skipped_repos or phase not in activity_phases)]
+    link_unlinked_committers()
     process.completion_percentage = 100
     process.status = "F"
     process.data = ProjectGroupSerializer(project_group).data
-    process.save()
+    process.data["failed_repositories"] = failed_repos
+    process.data["skipped_repositories"] = skipped_repos
+    process.save(update_fields=["completion_percentage", "status", "data"])
     print(f"Added users {new_users}")
+    if len(skipped_repos) > 0:
+        print(f"Skipped {len(skipped_repos)} repos without GitLab activity since their last sync")
+    if len(failed_repos) > 0:
+        print(f"Failed to refresh repos {failed_repos}")
     print(f"Finished process with hash {process.hash}")
 
 
@@ -118,214 +243,384 @@ def update_process(process, done, total, data=""):
     if total == done:
         process.status = "F"
         process.data = data
-    process.save()
+    process.save(update_fields=["completion_percentage", "status", "data"])
 
 
-def update_repository(id, user, new_users, user_token, process=None):
-    repo = Repository.objects.filter(pk=id).first()
+def get_issue_notes(client, repo, issue_iid):
+    return client.get_all_pages(f"/projects/{repo.gitlab_id}/issues/{issue_iid}/notes")
+
+
+def sync_members(client, repo, metrics):
     project = repo.project
-    assessment_category_root = project.project_group.assessment_calculation.assessment_category
-    base_url = "https://gitlab.cs.ttu.ee"
-    api_part = "/api/v4"
-    token_part = f"?private_token={get_token(repo, user, user_token)}&per_page=100"
-
-    times = []
-
-    # Refresh users
-    times.append(time.time())  # 0
-    answer_json = get_members_from_repo(repo, user, False, user_token)
-    if process is not None: update_process(process, 1, 10)
-    user_objects = []
-    if not isinstance(answer_json, list):
-        print()
-        print("Error parsing response from get members")
-        print(f"Repo {repo.pk}")
-        print(f"Response was: {answer_json}")
-        print("Expected list")
-        print()
-        return repo
-    times.append(time.time())  # 1
-    for member in answer_json:
-        if member["access_level"] >= 30:
-            create_user(member['username'], user_objects)
-    if process is not None: update_process(process, 2, 10)
-    times.append(time.time())  # 2
-    for user_object in user_objects:
-        if UserProject.objects.filter(account=user_object).filter(project=repo.project).count() == 0:
-            user_project = UserProject.objects.create(rights="M", account=user_object, project=project, colour=helpers.random_colour())
-            assessment_tree.add_user_assessment_recursive(user_project, assessment_category_root)
-    times.append(time.time())  # 3
-    if process is not None: update_process(process, 3, 10)
-
-    # Load all milestones
-    endpoint_part = f"/projects/{repo.gitlab_id}/milestones"
-    answer = requests.get(base_url + api_part + endpoint_part + token_part).json()
-    times.append(time.time())  # 4
-    for milestone in answer:
-        gitlab_id = milestone["id"]
-        matching = repo.milestones.filter(gitlab_id=gitlab_id)
-        if matching.count() == 0:
-            Milestone.objects.create(repository=repo, title=milestone["title"], gitlab_id=milestone["id"], gitlab_link=milestone["web_url"])
-        elif matching.count() == 1:
-            milestone_object = matching.first()
+    # Reconciled into the repository's project, which can change, so unchanged members still have to be added to a new project
+    members = client.get_all_pages_conditional(f"/projects/{repo.gitlab_id}/members", scope=f"project-{project.pk}")
+    if not isinstance(members.data, list):
+        raise GitlabError(f"Expected a list of members for repo {repo.pk}, got {str(members.data)[:500]}")
+    if not members.not_modified:
+        user_objects = create_users([member['username'] for member in members.data if member["access_level"] >= 30])
+        assessment_category_root = project.project_group.assessment_calculation.assessment_category
+        existing_accounts = set(UserProject.objects.filter(project=project).filter(account__in=user_objects).values_list("account_id", flat=True))
+        for user_object in user_objects:
+            if user_object.pk not in existing_accounts:
+                user_project = UserProject.objects.create(rights="M", account=user_object, project=project, colour=helpers.random_colour())
+                assessment_tree.add_user_assessment_recursive(user_project, assessment_category_root)
+                metrics.add_rows(inserted=1)
+            else:
+                metrics.add_rows(unchanged=1)
+        members.store()
+
+
+def reconcile_milestones(milestones, existing, metrics, **owner):
+    milestones_by_gitlab_id = {}
+    for milestone_object in existing.filter(gitlab_id__in=[milestone["id"] for milestone in milestones]):
+        milestones_by_gitlab_id.setdefault(milestone_object.gitlab_id, []).append(milestone_object)
+    new_milestones = []
+    changed_milestones = []
+    for milestone in milestones:
+        matching = milestones_by_gitlab_id.get(milestone["id"], [])
+        digest = bulk_ingest.milestone_hash(milestone)
+        if len(matching) == 0:
+            new_milestones.append(Milestone(title=milestone["title"], gitlab_id=milestone["id"], gitlab_link=milestone["web_url"], content_hash=digest, **owner))
+        elif len(matching) == 1 and matching[0].content_hash == digest:
+            metrics.add_rows(unchanged=1)
+        elif len(matching) == 1:
+            milestone_object = matching[0]
             # TODO: Maybe record the changes somehow?
             milestone_object.title = milestone["title"]
             milestone_object.gitlab_link = milestone["web_url"]
-            milestone_object.save()
-    times.append(time.time())  # 5
-    if process is not None: update_process(process, 4, 10)
-    print("Here")
-    endpoint_part = f"/projects/{repo.gitlab_id}"
-    answer = requests.get(base_url + api_part + endpoint_part + token_part).json()
-    times.append(time.time())  # 6
-    if answer["namespace"]["kind"] == "group":
-        print("GROUP")
-        endpoint_part = f"/groups/{answer['namespace']['id']}/milestones"
-        answer = requests.get(base_url + api_part + endpoint_part + token_part).json()
-        for milestone in answer:
-            gitlab_id = milestone["id"]
-            matching = repo.milestones.filter(gitlab_id=gitlab_id)
-            if matching.count() == 0:
-                Milestone.objects.create(project=repo.project, title=milestone["title"], gitlab_id=milestone["id"], gitlab_link=milestone["web_url"])
-            elif matching.count() == 1:
-                milestone_object = matching.first()
-                # TODO: Maybe record the changes somehow?
-                milestone_object.title = milestone["title"]
-                milestone_object.gitlab_link = milestone["web_url"]
-                milestone_object.save()
-    print("Done")
-    times.append(time.time())  # 7
-
-    # Load all issues
-    issues = []
-    endpoint_part = f"/projects/{repo.gitlab_id}/issues"
-    counter = 1
-    issues_to_refresh = []
-    while True:
-        answer = requests.get(base_url + api_part + endpoint_part + token_part + "&updated_after=" + repo.last_issue_sync.isoformat() + "&page=" + str(counter)).json()
-        issues += answer
-        if len(answer) < 100:
-            break
-        counter += 1
-    repo.last_issue_sync = datetime.datetime.now()
-    repo.save()
-    times.append(time.time())  # 8
-    if process is not None: update_process(process, 5, 10)
-    for issue in issues:
-        gitlab_id = issue['id']
-        gitlab_iid = issue['iid']
-        title = issue['title']
-        milestone = issue['milestone']
-        url = issue["web_url"]
-        closed_by = issue["closed_by"]
-        author = issue["author"]
-        assignee = issue["assignee"]
-
-        issues_to_refresh.append((gitlab_iid, gitlab_id))
-        issue_query = Issue.objects.filter(gitlab_id=gitlab_id)
-        issue_object = Issue.objects.create(gitlab_id=gitlab_id, gitlab_iid=gitlab_iid) if issue_query.count() == 0 else issue_query.first()
-
-        if milestone is not None:
-            milestone_object = Milestone.objects.filter(gitlab_id=milestone['id']).first()
-            if issue_object.milestone != milestone_object:
-                issue_object.has_been_moved = True
-            issue_object.milestone = milestone_object
-
-        if title is not None:
-            issue_object.title = title
-        if url is not None:
-            issue_object.gitlab_link = url
-        issue_object.repository = repo
-        if closed_by is not None:
-            issue_object.closed_by = User.objects.filter(username=closed_by["username"]).first()
-        if author is not None:
-            issue_object.author = User.objects.filter(username=author["username"]).first()
-        if assignee is not None:
-            issue_object.assignee = User.objects.filter(username=assignee["username"]).first()
-        issue_object.save()
-    times.append(time.time())  # 9
-
-    if process is not None: update_process(process, 6, 10)
-
-    # Load all time spent
-    time_spents = []
-
-    for issue, id in issues_to_refresh:
-        endpoint_part = f"/projects/{repo.gitlab_id}/issues/{issue}/notes"
-        counter = 1
-        while True:
-            url = base_url + api_part + endpoint_part + token_part + "&page=" + str(counter)
-            answer = requests.get(url).json()
-            time_spents += [(id, x) for x in answer]
-            if len(answer) < 100:
-                break
-            counter += 1
-    times.append(time.time())  # 10
-    if process is not None: update_process(process, 7, 10)
-    for id, note in time_spents:
-        body = note['body']
-        author = note['author']['username']
-        is_time_spent, amount = is_time_spent_message(body)
-        gitlab_id = note['id']
-        if is_time_spent:
-            user = User.objects.filter(username=author)
-            if user.count() == 0:
-                print(f"Error, unknown user {author} logged time, repo id {repo.gitlab_id}")
-                if author not in new_users:
-                    new_users.append(author)
-                continue
-            if TimeSpent.objects.filter(gitlab_id=gitlab_id).count() == 0:
-                user = user.first()
-                created_at = note['created_at']
-                issue = Issue.objects.filter(gitlab_id=id).first()
-                TimeSpent.objects.create(gitlab_id=gitlab_id, amount=amount, time=created_at, issue=issue, user=user)
-        else:
-            pass
-    times.append(time.time())  # 11
-    if process is not None: update_process(process, 8, 10)
-
-    # Load all commits
-    # TODO: Load commit data
-    print("Should load commits")
-    endpoint_part = f"/projects/{repo.gitlab_id}/repository/commits"
-    counter = 1
-    commits = []
-    while True:
-        answer = requests.get(base_url + api_part + endpoint_part + token_part + "&with_stats=true&page=" + str(counter)).json()
-        commits += answer
-        if len(answer) < 100:
-            break
-        counter += 1
-    times.append(time.time())  # 12
-    if process is not None: update_process(process, 9, 10)
-    for commit in commits:
-        commit_hash = commit["id"]
-        if Commit.objects.filter(hash=commit_hash).count() > 0:
-            continue
-        commit_time = commit["created_at"]
-        message = commit["message"]
-        lines_added = commit["stats"]["additions"]
-        lines_removed = commit["stats"]["deletions"]
-        name = commit["committer_name"]
-        email = commit["committer_email"]
-        committers = Committer.objects.filter(name=name).filter(email=email)
-        if committers.count() > 0:
-            committer = committers.first()
+            milestone_object.content_hash = digest
+            changed_milestones.append(milestone_object)
+    Milestone.objects.bulk_create(new_milestones)
+    Milestone.objects.bulk_update(changed_milestones, bulk_ingest.milestone_update_fields)
+    metrics.add_rows(inserted=len(new_milestones), updated=len(changed_milestones))
+
+
+def sync_milestones(client, repo, metrics, include_group_milestones=True):
+    # Reconciled into this repository row, a re-added repository or the same project in another group starts without them
+    milestones = client.get_all_pages_conditional(f"/projects/{repo.gitlab_id}/milestones", scope=f"repository-{repo.pk}")
+    if not milestones.not_modified:
+        reconcile_milestones(milestones.data, repo.milestones, metrics, repository=repo)
+        milestones.store()
+    if not include_group_milestones:
+        return
+    project_info = client.get_conditional(f"/projects/{repo.gitlab_id}")
+    if project_info.data["namespace"]["kind"] == "group":
+        group_milestones = client.get_all_pages_conditional(f"/groups/{project_info.data['namespace']['id']}/milestones", scope=f"project-{repo.project.pk}")
+        if not group_milestones.not_modified:
+            reconcile_milestones(group_milestones.data, repo.project.milestones, metrics, project=repo.project)
+            group_milestones.store()
+    project_info.store()
+
+
+def sync_issues(client, repo, metrics, checkpoint):
+    state = checkpoint.state(repo.pk)
+    if "issue_sync_start" not in state:
+        checkpoint.update(repo.pk, issue_sync_start=timezone.now().isoformat(), issues_listed_since=repo.last_issue_sync.isoformat(),
+                          issues_cursor=updated_cursor(repo.last_issue_sync.isoformat()))
+    pages = client.iter_updated_pages(f"/projects/{repo.gitlab_id}/issues", state["issues_cursor"])
+    for cursor, issues in prefetch(pages):
+        bulk_ingest.ingest_issues(repo, issues, metrics)
+        checkpoint.update(repo.pk, issues_cursor=cursor)
+    repo.last_issue_sync = datetime.datetime.fromisoformat(state["issue_sync_start"])
+    repo.save(update_fields=["last_issue_sync"])
+
+
+def get_issues_to_refresh(repo):
+    # Issues whose saved time spents don't cover the total GitLab last reported, including the ones an interrupted sync didn't get to
+    issues = Issue.objects.filter(repository=repo).filter(gitlab_total_time_spent__isnull=False)
+    issues = issues.filter(Q(total_time_spent__isnull=True) | ~Q(total_time_spent=F("gitlab_total_time_spent")))
+    return list(issues.order_by("pk").values_list("gitlab_iid", "gitlab_id", "gitlab_total_time_spent"))
+
+
+def iter_issue_notes(client, repo, issues_to_refresh, notes_workers):
+    with ThreadPoolExecutor(max_workers=notes_workers) as executor:
+        for issues in bulk_ingest.chunks(issues_to_refresh, notes_workers * 4):
+            notes_per_issue = executor.map(lambda issue: get_issue_notes(client, repo, issue[0]), issues)
+            yield issues, [(id, note) for (_, id, _), notes in zip(issues, notes_per_issue) for note in notes]
+
+
+def sync_time_spent(client, repo, new_users, metrics, checkpoint, notes_workers=None):
+    state = checkpoint.state(repo.pk)
+    notes_workers = max(1, notes_workers if notes_workers is not None else settings.GITLAB_NOTES_FETCH_WORKERS)
+    if "time_sync_start" not in state:
+        # Logging time updates the issue, so the totals are fresh if this sync already listed the issues changed since the time watermark
+        listed = "issues_listed_since" in state and datetime.datetime.fromisoformat(state["issues_listed_since"]) <= repo.last_time_sync
+        if listed:
+            checkpoint.update(repo.pk, time_sync_start=state["issue_sync_start"], time_issues_cursor=None)
         else:
-            committer = Committer.objects.create(name=name, email=email)
-            users = User.objects.filter(username=name)
-            if users.count() > 0:
-                committer.account = users.first()
-                committer.save()
-            if "@" in email:
-                users = User.objects.filter(username=email.split("@")[0])
-                if users.count() > 0:
-                    committer.account = users.first()
-                    committer.save()
-        Commit.objects.create(hash=commit_hash, time=commit_time, message=message, lines_added=lines_added, lines_removed=lines_removed, author=committer, repository=repo)
-        print(commit)
-    times.append(time.time())  # 13
-    if process is not None: update_process(process, 10, 10)
-    for i in range(len(times) - 1):
-        print(f"{i}: {times[i + 1] - times[i]}")
+            checkpoint.update(repo.pk, time_sync_start=timezone.now().isoformat(), time_issues_cursor=updated_cursor(repo.last_time_sync.isoformat()))
+    if state["time_issues_cursor"] is not None:
+        for cursor, issues in prefetch(client.iter_updated_pages(f"/projects/{repo.gitlab_id}/issues", state["time_issues_cursor"])):
+            bulk_ingest.ingest_issues(repo, issues, metrics)
+            checkpoint.update(repo.pk, time_issues_cursor=cursor)
+    for issues, time_spents in prefetch(iter_issue_notes(client, repo, get_issues_to_refresh(repo), notes_workers)):
+        metrics.add_rows(inserted=save_time_spents(repo, time_spents, new_users))
+        for issue, id, total_time_spent in issues:
+            metrics.add_rows(updated=Issue.objects.filter(gitlab_id=id).update(total_time_spent=total_time_spent))
+    # The time watermark only moves once the notes of every changed issue are saved
+    repo.last_time_sync = datetime.datetime.fromisoformat(state["time_sync_start"])
+    repo.save(update_fields=["last_time_sync"])
+
+
+def get_head_commit(client, repo):
+    commits = client.get(f"/projects/{repo.gitlab_id}/repository/commits", {"per_page": 1})
+    return commits[0]["id"] if len(commits) > 0 else None
+
+
+def get_commits_since(repo):
+    return (repo.last_commit_sync - datetime.timedelta(hours=settings.GITLAB_COMMIT_SYNC_OVERLAP_HOURS)).isoformat()
+
+
+def list_commits(client, repo, metrics, checkpoint, resolver):
+    state = checkpoint.state(repo.pk)
+    commit_params = {"with_stats": "true", "ref_name": state["commit_ref"]}
+    if state["commit_since"] is not None:
+        commit_params["since"] = state["commit_since"]
+    listed = 0
+    pages = prefetch(client.iter_numbered_pages(f"/projects/{repo.gitlab_id}/repository/commits", commit_params, state["commits_page"] + 1))
+    # A first import is gathered into batches big enough for COPY, later syncs write every page as it arrives
+    for page, commits in bulk_ingest.batched(pages, settings.COMMIT_COPY_THRESHOLD if state["first_commit_import"] else 1):
+        new_commit_count = bulk_ingest.ingest_commits(repo, commits, resolver, state["first_commit_import"])
+        metrics.add_rows(inserted=new_commit_count, unchanged=len(commits) - new_commit_count)
+        checkpoint.update(repo.pk, commits_page=page)
+        listed += len(commits)
+    return listed
+
+
+def sync_commits(client, repo, metrics, checkpoint, full_commit_sync=False, committer_resolver=None):
+    state = checkpoint.state(repo.pk)
+    if "commit_sync_start" not in state:
+        # Listed up to the head seen now, a push during the sync is left for the next one
+        head = get_head_commit(client, repo)
+        # GitLab's since filters on commit dates, so a branch merged long after its commits were made only shows up in the range since the last head
+        ref, since = head, None
+        if head is None or (head == repo.last_commit_sha and not full_commit_sync):
+            ref = None
+        elif repo.last_commit_sha is not None and not full_commit_sync:
+            ref = f"{repo.last_commit_sha}..{head}"
+        elif not full_commit_sync:
+            since = get_commits_since(repo)
+        checkpoint.update(repo.pk, commit_sync_start=timezone.now().isoformat(), commit_head=head, commit_ref=ref, commit_since=since, commits_page=0,
+                          first_commit_import=not Commit.objects.filter(repository=repo).exists())
+    resolver = committer_resolver if committer_resolver is not None else CommitterResolver()
+    if state["commit_ref"] is not None:
+        try:
+            listed = list_commits(client, repo, metrics, checkpoint, resolver)
+        except GitlabError as e:
+            if e.status_code != 404 or ".." not in state["commit_ref"]:
+                raise
+            listed = 0
+        # The last head is gone or no longer behind the new one, e.g. after a force push
+        if listed == 0 and state["commits_page"] == 0 and ".." in state["commit_ref"]:
+            print(f"Commit {repo.last_commit_sha} of repo {repo.pk} isn't behind the head anymore, listing commits by date")
+            checkpoint.update(repo.pk, commit_ref=state["commit_head"], commit_since=get_commits_since(repo))
+            list_commits(client, repo, metrics, checkpoint, resolver)
+    if committer_resolver is None:
+        link_unlinked_committers()
+    repo.last_commit_sync = datetime.datetime.fromisoformat(state["commit_sync_start"])
+    repo.last_commit_sha = state["commit_head"] if state["commit_head"] is not None else repo.last_commit_sha
+    repo.save(update_fields=["last_commit_sync", "last_commit_sha"])
+
+
+def has_new_activity(repo, last_activity_at):
+    if repo.last_activity_at is None or last_activity_at is None:
+        return True
+    # Changes GitLab doesn't count as activity, like new members, are still picked up once in a while
+    last_sync = min(repo.last_issue_sync, repo.last_time_sync, repo.last_commit_sync)
+    if last_sync < timezone.now() - datetime.timedelta(days=settings.SYNC_INACTIVE_RECHECK_DAYS):
+        return True
+    # Activity within the update interval after the saved value doesn't move it, so only a sync started after that covers it
+    if last_sync < repo.last_activity_at + datetime.timedelta(seconds=settings.GITLAB_ACTIVITY_UPDATE_INTERVAL):
+        return True
+    return parse_datetime(last_activity_at) > repo.last_activity_at
+
+
+def has_changed_issues(client, repo):
+    # Logged time doesn't count as project activity on GitLab, but it does update the issue
+    updated_after = min(repo.last_issue_sync, repo.last_time_sync).isoformat()
+    return len(client.get(f"/projects/{repo.gitlab_id}/issues", {"updated_after": updated_after, "per_page": 1})) > 0
+
+
+def get_group_repositories(client, project_group, repos):
+    group_repos = {}
+    projects = client.iter_pages(f"/groups/{project_group.group_id}/projects", {"include_subgroups": "true", "simple": "true"})
+    for page in prefetch(projects):
+        for gitlab_project in page:
+            if gitlab_project["id"] in repos:
+                group_repos[gitlab_project["id"]] = (repos[gitlab_project["id"]], gitlab_project)
+    return group_repos
+
+
+def sync_group_milestones(client, project_group, group_repos, checkpoint, metrics):
+    repos_per_namespace = {}
+    for repo, gitlab_project in group_repos.values():
+        if gitlab_project["namespace"]["kind"] == "group":
+            repos_per_namespace.setdefault(gitlab_project["namespace"]["id"], []).append(repo)
+    for namespace_id, repos in repos_per_namespace.items():
+        projects = {repo.project.pk: repo.project for repo in repos}
+        # The cache entry is only valid for the same set of projects, a new project needs the milestones too
+        scope = f"group-{project_group.pk}-projects-" + hashlib.md5(",".join(str(pk) for pk in sorted(projects)).encode()).hexdigest()
+        milestones = client.get_all_pages_conditional(f"/groups/{namespace_id}/milestones", scope=scope)
+        if not milestones.not_modified:
+            for project in projects.values():
+                reconcile_milestones(milestones.data, project.milestones, metrics, project=project)
+            milestones.store()
+        checkpoint.update_many({repo.pk: {"group_milestones": True} for repo in repos})
+
+
+def sync_group_issues(client, project_group, group_repos, checkpoint, metrics, phases, inactive):
+    # Repositories still waiting for their members list their own issues later, so that the issue users exist
+    repos = {gitlab_id: repo for gitlab_id, (repo, _) in group_repos.items()
+             if (checkpoint.is_done(repo.pk, "members") or "members" not in phases or repo.pk in inactive) and "issues_listed_since" not in checkpoint.state(repo.pk)}
+    if len(repos) == 0:
+        return
+    state = checkpoint.state("group")
+    if "issue_sync_start" not in state:
+        watermarks = [repo.last_issue_sync for repo in repos.values() if "issues" in phases] + [repo.last_time_sync for repo in repos.values() if "time_spent" in phases]
+        checkpoint.update("group", issue_sync_start=timezone.now().isoformat(), updated_after=min(watermarks).isoformat(),
+                          issues_cursor=updated_cursor(min(watermarks).isoformat()))
+    pages = client.iter_updated_pages(f"/groups/{project_group.group_id}/issues", state["issues_cursor"], {"scope": "all"})
+    for cursor, issues in prefetch(pages):
+        issues_per_repo = {}
+        for issue in issues:
+            if issue["project_id"] in repos:
+                issues_per_repo.setdefault(issue["project_id"], []).append(issue)
+        for gitlab_id, repo_issues in issues_per_repo.items():
+            bulk_ingest.ingest_issues(repos[gitlab_id], repo_issues, metrics)
+        # Logged time doesn't count as project activity, changed issues bring skipped repositories back into the sync
+        checkpoint.update_many({"group": {"issues_cursor": cursor}, **{repos[gitlab_id].pk: {"has_changed_issues": True} for gitlab_id in issues_per_repo}})
+    listed = {"issues_listed_since": state["updated_after"], "issue_sync_start": state["issue_sync_start"]}
+    if "issues" not in phases:
+        # Only listed for the time spents, which move their own watermark
+        checkpoint.update_many({repo.pk: listed for repo in repos.values()})
+        return
+    Repository.objects.filter(pk__in=[repo.pk for repo in repos.values()]).update(last_issue_sync=datetime.datetime.fromisoformat(state["issue_sync_start"]))
+    checkpoint.update_many({repo.pk: {"done": checkpoint.state(repo.pk).get("done", []) + ["issues"], **listed} for repo in repos.values()})
+
+
+class GroupSync:
+    # Issues and group milestones are fetched once for the whole GitLab group and routed to repositories by project id
+    def __init__(self, project_group, token_pool, checkpoint, process=None, phases=None, force=False):
+        self.project_group = project_group
+        self.checkpoint = checkpoint
+        self.process = process
+        self.phases = phases if phases is not None else repository_phases
+        self.client = GitlabClient(token_pool.pick())
+        self.group_repos = {}
+        self.inactive = set()
+        if project_group.group_id is None or checkpoint.state("group").get("failed", False):
+            return
+        repos = {repo.gitlab_id: repo for repo in Repository.objects.filter(project__project_group=project_group).filter(gitlab_id__isnull=False).select_related("project")}
+        if len(repos) > 0:
+            sync_phases = {"group_projects": lambda metrics: self.load_projects(repos, force)}
+            if "milestones" in self.phases:
+                sync_phases["group_milestones"] = lambda metrics: sync_group_milestones(self.client, project_group, self.group_repos, checkpoint, metrics)
+            self.run(sync_phases)
+
+    def load_projects(self, repos, force):
+        # Inactive repositories stay routable, the group issues can still show changes for them
+        self.group_repos = get_group_repositories(self.client, self.project_group, repos)
+        for repo, gitlab_project in self.group_repos.values():
+            if not force and any(phase in activity_phases for phase in self.phases) and not self.checkpoint.state(repo.pk).get("has_changed_issues", False) and not has_new_activity(repo, gitlab_project.get("last_activity_at")):
+                self.inactive.add(repo.pk)
+        # A retried attempt keeps the activity seen first, later activity may not be covered by the phases already done
+        self.checkpoint.update_many({repo.pk: {"last_activity_at": self.checkpoint.state(repo.pk).get("last_activity_at", gitlab_project.get("last_activity_at"))}
+                                     for repo, gitlab_project in self.group_repos.values()})
+
+    @property
+    def active(self):
+        return len(self.group_repos) > 0
+
+    @property
+    def lists_issues(self):
+        return self.active and ("issues" in self.phases or "time_spent" in self.phases)
+
+    def sync_issues(self):
+        if self.lists_issues:
+            self.run({"group_issues": lambda metrics: sync_group_issues(self.client, self.project_group, self.group_repos, self.checkpoint, metrics, self.phases, self.inactive)})
+            self.inactive = {pk for pk in self.inactive if not self.checkpoint.state(pk).get("has_changed_issues", False)}
+
+    def run(self, sync_phases):
+        recorder = sync_metrics.SyncRecorder(self.client, self.process, project_group=self.project_group)
+        try:
+            for phase, sync_phase in sync_phases.items():
+                # The projects list is needed to route anything else, so every attempt fetches it again
+                if phase == "group_projects" or not self.checkpoint.is_done("group", phase):
+                    with recorder.phase(phase) as metrics:
+                        sync_phase(metrics)
+                    if phase != "group_projects": self.checkpoint.mark_done("group", phase)
+        except Exception:
+            # Every repository falls back to fetching its own issues and milestones, also in later attempts
+            print(f"Group level sync of project group {self.project_group.pk} failed: {traceback.format_exc()}")
+            recorder.finish("E", traceback.format_exc())
+            self.checkpoint.update("group", failed=True)
+            self.group_repos = {}
+            self.inactive = set()
+            return
+        recorder.finish()
+
+
+repository_phases = ["members", "milestones", "issues", "time_spent", "commits"]
+# Changes GitLab shows as project activity or changed issues, members and milestones are synced whatever the activity
+activity_phases = ["issues", "time_spent", "commits"]
+sync_scopes = {"members": "members", "milestones": "milestones", "issues": "issues", "time": "time_spent", "commits": "commits"}
+
+
+def get_sync_phases(scope):
+    # A list or a comma separated string of sync_scopes keys, nothing means a full sync
+    if scope is None or len(scope) == 0:
+        return None
+    if isinstance(scope, str):
+        scope = scope.split(",")
+    unknown = [name for name in scope if name not in sync_scopes]
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown sync scope {', '.join(unknown)}, expected some of {', '.join(sync_scopes)}")
+    return [sync_scopes[name] for name in sync_scopes if name in scope]
+
+
+def update_repository(id, user, new_users, user_token, process=None, notes_workers=None, full_commit_sync=False, committer_resolver=None, group_process=None, checkpoint=None, phases=None,
+                      token_pool=None, skip_inactive=False):
+    repo = Repository.objects.filter(pk=id).first()
+    checkpoint = checkpoint if checkpoint is not None else Checkpoint(process)
+    state = checkpoint.state(repo.pk)
+    phases = phases if phases is not None else repository_phases
+    if all(checkpoint.is_done(repo.pk, phase) for phase in phases):
+        return repo
+    token_pool = token_pool if token_pool is not None else get_token_pool(repo.project.project_group, user_token)
+    with token_pool.lease() as token:
+        client = GitlabClient(token)
+        if skip_inactive and "last_activity_at" not in state and "inactive" not in state and any(phase in activity_phases for phase in phases):
+            last_activity_at = client.get(f"/projects/{repo.gitlab_id}").get("last_activity_at")
+            if not has_new_activity(repo, last_activity_at) and not has_changed_issues(client, repo):
+                checkpoint.update(repo.pk, inactive=True)
+            else:
+                checkpoint.update(repo.pk, last_activity_at=last_activity_at)
+        if skip_inactive and state.get("inactive", False):
+            print(f"Skipping issues, time spent and commits of repo {repo.pk}, no GitLab activity since its last sync")
+            phases = [phase for phase in phases if phase not in activity_phases]
+            if all(checkpoint.is_done(repo.pk, phase) for phase in phases):
+                return repo
+        sync_phases = {
+            "members": lambda metrics: sync_members(client, repo, metrics),
+            "milestones": lambda metrics: sync_milestones(client, repo, metrics, not state.get("group_milestones", False)),
+            "issues": lambda metrics: sync_issues(client, repo, metrics, checkpoint),
+            "time_spent": lambda metrics: sync_time_spent(client, repo, new_users, metrics, checkpoint, notes_workers),
+            "commits": lambda metrics: sync_commits(client, repo, metrics, checkpoint, full_commit_sync, committer_resolver)
+        }
+        recorder = sync_metrics.SyncRecorder(client, process if process is not None else group_process, repository=repo)
+        try:
+            for done, phase in enumerate(phases):
+                if not checkpoint.is_done(repo.pk, phase):
+                    with recorder.phase(phase) as metrics:
+                        sync_phases[phase](metrics)
+                    checkpoint.mark_done(repo.pk, phase)
+                if process is not None and done + 1 < len(phases): update_process(process, done + 1, len(phases))
+        except Exception:
+            recorder.finish("E", traceback.format_exc())
+            raise
+        recorder.finish()
+    if all(checkpoint.is_done(repo.pk, phase) for phase in repository_phases) and state.get("last_activity_at") is not None:
+        repo.last_activity_at = parse_datetime(state["last_activity_at"])
+        repo.save(update_fields=["last_activity_at"])
+    if process is not None: update_process(process, len(phases), len(phases))
     return repo
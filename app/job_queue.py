@@ -0,0 +1,218 @@
+import datetime
+import hashlib
+import os
+import socket
+import threading
+import time
+import traceback
+
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, close_old_connections, transaction
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Process, ProjectGroup
+
+from . import gitlab_helper
+from . import security
+
+
+def get_id_hash(name, id):
+    hid = hashlib.sha256()
+    [hid.update(str(x).encode()) for x in [name, id]]
+    return hid.hexdigest()
+
+
+def get_active_process(id_hash):
+    return Process.objects.filter(id_hash=id_hash).filter(status__in=["Q", "O"]).order_by("pk").first()
+
+
+def get_process_hash(name, id, user):
+    h = hashlib.sha256()
+    [h.update(str(x).encode()) for x in [time.time(), name, id, user.pk if user is not None else None]]
+    return h.hexdigest()
+
+
+def merge_arguments(queued, arguments, user, user_token):
+    # The queued job runs once for everyone who asked for it, so it keeps every flag that was turned on and the newest token
+    merged = dict(queued or {})
+    for key, value in arguments.items():
+        merged[key] = (value or merged.get(key, False)) if isinstance(value, bool) else value
+    if user_token is not None:
+        merged["user"] = user.pk if user is not None else None
+        merged["token"] = security.encrypt_for_server(user_token)
+    return merged
+
+
+def enqueue(process_type, name, id, user, arguments, user_token=None, priority=Process.SyncPriority.GROUP, project_group=None):
+    id_hash = get_id_hash(name, id)
+    old = get_active_process(id_hash)
+    if old is not None:
+        if old.status == "Q":
+            # Someone is now waiting for a sync that was queued in the background
+            old.priority = min(old.priority, priority)
+            old.arguments = merge_arguments(old.arguments, arguments, user, user_token)
+            old.save(update_fields=["priority", "arguments"])
+        return old
+    arguments = dict(arguments)
+    arguments["user"] = user.pk if user is not None else None
+    arguments["token"] = security.encrypt_for_server(user_token)
+    return Process.objects.create(hash=get_process_hash(name, id, user), id_hash=id_hash, type=process_type, status="Q", completion_percentage=0,
+                                  arguments=arguments, max_attempts=settings.SYNC_JOB_MAX_ATTEMPTS, priority=priority, project_group=project_group)
+
+
+def get_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim(worker_name, interactive_only=False):
+    with transaction.atomic():
+        running = Process.objects.filter(status="O")
+        # The bound is checked without a lock, so workers claiming at the same moment can go over it by a few
+        if running.exclude(priority=Process.SyncPriority.INTERACTIVE).count() >= settings.SYNC_MAX_RUNNING_JOBS:
+            interactive_only = True
+        queued = Process.objects.filter(status="Q").filter(Q(run_after__isnull=True) | Q(run_after__lte=timezone.now()))
+        if interactive_only:
+            queued = queued.filter(priority=Process.SyncPriority.INTERACTIVE)
+        # Within a priority, project groups with fewer running syncs go first so one big group doesn't hold up the others
+        running_in_group = running.filter(project_group=OuterRef("project_group")).order_by().values("project_group").annotate(count=Count("pk")).values("count")
+        process = queued.annotate(running_in_group=Coalesce(Subquery(running_in_group), 0)) \
+            .order_by("priority", "running_in_group", "created_at", "pk").select_for_update(skip_locked=True).first()
+        if process is None:
+            return None
+        process.status = "O"
+        process.locked_by = worker_name
+        process.heartbeat = timezone.now()
+        process.attempts += 1
+        process.save(update_fields=["status", "locked_by", "heartbeat", "attempts"])
+        return process
+
+
+def without_token(arguments):
+    arguments = dict(arguments or {})
+    arguments.pop("token", None)
+    return arguments
+
+
+def finish(process):
+    process.refresh_from_db(fields=["status", "completion_percentage"])
+    if process.status == "O":
+        process.status = "F"
+    process.locked_by = None
+    process.arguments = without_token(process.arguments)
+    process.save(update_fields=["status", "locked_by", "arguments"])
+
+
+def fail(process, error):
+    print(f"Process {process.pk} failed on attempt {process.attempts}: {error}")
+    process.error = error
+    process.locked_by = None
+    # Processes started before the job queue have no arguments to run them again with
+    if process.attempts < process.max_attempts and process.arguments is not None:
+        process.status = "Q"
+        process.run_after = timezone.now() + datetime.timedelta(seconds=settings.SYNC_JOB_RETRY_DELAY * 2 ** max(0, process.attempts - 1))
+    else:
+        process.status = "E"
+        process.arguments = without_token(process.arguments)
+    process.save(update_fields=["status", "locked_by", "error", "run_after", "arguments"])
+
+
+def recover_stale_processes():
+    cutoff = timezone.now() - datetime.timedelta(seconds=settings.SYNC_JOB_STALE_AFTER)
+    with transaction.atomic():
+        stale = Process.objects.select_for_update(skip_locked=True).filter(status="O").filter(Q(heartbeat__lt=cutoff) | Q(heartbeat__isnull=True))
+        for process in stale:
+            fail(process, f"Worker {process.locked_by} stopped responding")
+
+
+def keep_alive(process_id, stop):
+    try:
+        while not stop.wait(settings.SYNC_JOB_HEARTBEAT_INTERVAL):
+            Process.objects.filter(pk=process_id).update(heartbeat=timezone.now())
+    finally:
+        connection.close()
+
+
+@contextmanager
+def heartbeat(process):
+    stop = threading.Event()
+    thread = threading.Thread(target=keep_alive, args=[process.pk, stop], daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+@contextmanager
+def interactive_process(process_type, name, id, user, project_group=None):
+    # Runs right away in the request, the process only tells background syncs to make room and shows up in the sync runs
+    process = Process.objects.create(hash=get_process_hash(name, id, user), id_hash=get_id_hash(name, id), type=process_type, status="O", completion_percentage=0,
+                                     locked_by=get_worker_name(), heartbeat=timezone.now(), attempts=1, max_attempts=1,
+                                     priority=Process.SyncPriority.INTERACTIVE, project_group=project_group)
+    with heartbeat(process):
+        try:
+            yield process
+        except Exception:
+            fail(process, traceback.format_exc())
+            raise
+        finish(process)
+
+
+def run_job(process):
+    arguments = process.arguments or {}
+    full_commit_sync = arguments.get("full_commit_sync", False)
+    phases = arguments.get("phases")
+    force = arguments.get("force", False)
+    try:
+        # A token that no longer decrypts, e.g. after SECRET_KEY changed, fails the job instead of the worker thread
+        user = User.objects.filter(pk=arguments.get("user")).first()
+        user_token = security.decrypt_for_server(arguments.get("token"))
+        if process.type == "SG":
+            project_group = ProjectGroup.objects.get(pk=arguments["project_group"])
+            gitlab_helper.update_all_repos_in_group(project_group, user, process, user_token, full_commit_sync, phases=phases, force=force)
+        elif process.type == "SR":
+            gitlab_helper.update_repository(arguments["repository"], user, [], user_token, process, full_commit_sync=full_commit_sync, phases=phases)
+        else:
+            raise ValueError(f"Unknown process type {process.type}")
+        finish(process)
+    except Exception:
+        fail(process, traceback.format_exc())
+
+
+def run_job_in_thread(process):
+    try:
+        with heartbeat(process):
+            run_job(process)
+    finally:
+        connection.close()
+
+
+def work(worker_name=None, poll_interval=None, once=False, slots=None):
+    worker_name = worker_name if worker_name is not None else get_worker_name()
+    poll_interval = poll_interval if poll_interval is not None else settings.SYNC_WORKER_POLL_INTERVAL
+    slots = max(1, slots if slots is not None else settings.SYNC_WORKER_SLOTS)
+    running = []
+    print(f"Sync worker {worker_name} started with {slots} slots")
+    while True:
+        running = [thread for thread in running if thread.is_alive()]
+        close_old_connections()
+        recover_stale_processes()
+        process = None
+        if len(running) < slots:
+            # The last free slot is kept for interactive syncs, so those don't wait behind long group syncs
+            process = claim(worker_name, interactive_only=slots > 1 and len(running) == slots - 1)
+        if process is not None:
+            print(f"Worker {worker_name} starting process {process.pk} ({process.type}, {process.get_priority_display().lower()} priority)")
+            thread = threading.Thread(target=run_job_in_thread, args=[process])
+            thread.start()
+            running.append(thread)
+            continue
+        if once and len(running) == 0:
+            return
+        time.sleep(poll_interval)
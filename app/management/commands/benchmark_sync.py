@@ -0,0 +1,91 @@
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+
+from app.models import User, ProjectGroup, Project, Repository, AssessmentCategory, AssessmentCalculation, Process, \
+    Committer, GitlabResponseCache
+from app.management.commands.fake_gitlab import add_fake_gitlab_arguments, create_fake_gitlab
+
+from app import gitlab_helper
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self.lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+    def add_to_connection(self, sender, connection, **kwargs):
+        connection.execute_wrappers.append(self)
+
+
+def create_benchmark_group(data):
+    root = AssessmentCategory.objects.create(name="root", assessment_type="S")
+    project_group = ProjectGroup.objects.create(name="Sync benchmark", description="Created by benchmark_sync", group_id=data.group_id, gitlab_token="benchmark")
+    AssessmentCalculation.objects.create(assessment_category=root, project_group=project_group)
+    for fake_project in data.projects.values():
+        info = fake_project["project"]
+        project = Project.objects.create(name=info["name_with_namespace"], project_group=project_group)
+        Repository.objects.create(url=info["web_url"], gitlab_id=info["id"], name=info["name"], project=project)
+    return project_group
+
+
+def delete_benchmark_group(project_group, data, server_url):
+    usernames = [member["username"] for fake_project in data.projects.values() for member in fake_project["members"]]
+    Project.objects.filter(project_group=project_group).delete()
+    AssessmentCategory.objects.filter(pk=project_group.assessment_calculation.assessment_category_id).delete()
+    project_group.delete()
+    Committer.objects.filter(name__in=usernames).delete()
+    User.objects.filter(username__in=usernames).filter(profile__actual_account=False).delete()
+    GitlabResponseCache.objects.filter(url__startswith=server_url).delete()
+
+
+class Command(BaseCommand):
+    help = "Syncs a generated group from a local fake GitLab and reports wall time, HTTP requests, SQL queries and peak memory"
+
+    def add_arguments(self, parser):
+        add_fake_gitlab_arguments(parser)
+        parser.add_argument("--workers", type=int, default=None, help="Repositories synced in parallel, defaults to GROUP_SYNC_WORKERS")
+        parser.add_argument("--runs", type=int, default=2, help="Later runs show the cost of an incremental sync")
+        parser.add_argument("--keep", action="store_true", help="Keep the generated group in the database")
+
+    def handle(self, *args, **options):
+        server = create_fake_gitlab(options)
+        server.start_in_background()
+        project_group = create_benchmark_group(server.data)
+        counter = QueryCounter()
+        connection_created.connect(counter.add_to_connection)
+        connection.execute_wrappers.append(counter)
+        tracemalloc.start()
+        try:
+            with override_settings(GITLAB_URL=server.url):
+                for run in range(options["runs"]):
+                    process = Process.objects.create(hash=f"benchmark-{time.time()}", id_hash="benchmark", type="SG", status="O", completion_percentage=0)
+                    requests_before, bytes_before, queries_before = server.request_count, server.bytes_sent, counter.count
+                    tracemalloc.reset_peak()
+                    start = time.time()
+                    gitlab_helper.update_all_repos_in_group(project_group, None, process, None, workers=options["workers"])
+                    duration = time.time() - start
+                    peak_memory = tracemalloc.get_traced_memory()[1]
+                    process.delete()
+                    self.stdout.write(
+                        f"Run {run + 1}: {duration:.2f}s, {server.request_count - requests_before} HTTP requests, "
+                        f"{(server.bytes_sent - bytes_before) / 1024:.0f} KiB received, {counter.count - queries_before} SQL queries, "
+                        f"peak memory {peak_memory / 1024 / 1024:.1f} MiB"
+                    )
+        finally:
+            tracemalloc.stop()
+            connection_created.disconnect(counter.add_to_connection)
+            connection.execute_wrappers.remove(counter)
+            server.shutdown()
+            if not options["keep"]:
+                delete_benchmark_group(project_group, server.data, server.url)
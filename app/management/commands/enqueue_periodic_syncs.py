@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app.models import Process, ProjectGroup
+
+from app import job_queue
+
+
+class Command(BaseCommand):
+    help = "Queues a sync of every project group with a GitLab token, behind the syncs users asked for"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true", help="Also sync repositories without GitLab activity since their last sync")
+        parser.add_argument("--full-commit-sync", action="store_true", help="List the whole commit history again instead of the commits since the last synced head")
+
+    def handle(self, *args, **options):
+        for project_group in ProjectGroup.objects.filter(gitlab_token__isnull=False).order_by("pk"):
+            arguments = {"project_group": project_group.pk, "full_commit_sync": options["full_commit_sync"], "force": options["force"]}
+            process = job_queue.enqueue("SG", "project group update", project_group.pk, None, arguments, priority=Process.SyncPriority.PERIODIC, project_group=project_group)
+            self.stdout.write(f"Project group {project_group.pk}: process {process.pk} ({process.get_status_display().lower()})")
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from app.fake_gitlab import FakeGitlabData, FakeGitlabServer
+
+
+def add_fake_gitlab_arguments(parser):
+    parser.add_argument("--projects", type=int, default=10)
+    parser.add_argument("--members", type=int, default=5, help="Members per project")
+    parser.add_argument("--milestones", type=int, default=4, help="Milestones per project and in the group")
+    parser.add_argument("--issues", type=int, default=100, help="Issues per project")
+    parser.add_argument("--notes", type=int, default=4, help="Notes per issue, every other one logs time")
+    parser.add_argument("--commits", type=int, default=300, help="Commits per project")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--max-per-page", type=int, default=100)
+
+
+def create_fake_gitlab(options, host="127.0.0.1", port=0):
+    data = FakeGitlabData(projects=options["projects"], members=options["members"], milestones=options["milestones"],
+                          issues=options["issues"], notes=options["notes"], commits=options["commits"])
+    return FakeGitlabServer((host, port), data, options["latency"], options["max_per_page"])
+
+
+class Command(BaseCommand):
+    help = "Serves a fake GitLab API with generated group data, for profiling syncs without the real GitLab"
+
+    def add_arguments(self, parser):
+        add_fake_gitlab_arguments(parser)
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+
+    def handle(self, *args, **options):
+        server = create_fake_gitlab(options, options["host"], options["port"])
+        self.stdout.write(f"Fake GitLab group {server.data.group_id} with {len(server.data.projects)} projects at {server.url}, set GITLAB_URL to use it")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.shutdown()
@@ -0,0 +1,19 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+
+class Command(BaseCommand):
+    help = "Posts a recorded GitLab webhook payload to the local webhook endpoint"
+
+    def add_arguments(self, parser):
+        parser.add_argument("payload", help="JSON file with a recorded push, issue or note hook payload")
+        parser.add_argument("--token", required=True, help="Webhook secret of the repository's project group")
+
+    def handle(self, *args, **options):
+        with open(options["payload"]) as f:
+            payload = json.load(f)
+        client = Client(HTTP_HOST="localhost")
+        response = client.post("/webhooks/gitlab/", data=json.dumps(payload), content_type="application/json", HTTP_X_GITLAB_TOKEN=options["token"])
+        self.stdout.write(f"{response.status_code}: {response.content.decode()}")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from app import job_queue
+
+
+class Command(BaseCommand):
+    help = "Runs queued GitLab sync processes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--name", default=None, help="Worker name shown on claimed processes, defaults to host:pid")
+        parser.add_argument("--poll-interval", type=float, default=None, help="Seconds to wait when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+        parser.add_argument("--slots", type=int, default=None, help="Syncs run at once, defaults to SYNC_WORKER_SLOTS")
+
+    def handle(self, *args, **options):
+        job_queue.work(options["name"], options["poll_interval"], options["once"], options["slots"])
@@ -0,0 +1,19 @@
+# Generated by Django 4.0 on 2026-10-18 13:34
+
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0074_profile_store_passwords_in_local_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='last_commit_sync',
+            field=models.DateTimeField(default=datetime.datetime(1970, 1, 1, 0, 0)),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 13:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0075_repository_last_commit_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issue',
+            name='total_time_spent',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
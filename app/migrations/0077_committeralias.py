@@ -0,0 +1,24 @@
+# Generated by Django 4.0 on 2026-10-18 13:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('app', '0076_issue_total_time_spent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommitterAlias',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('N', 'Name'), ('E', 'Email')], default='E', max_length=1)),
+                ('alias', models.CharField(db_index=True, max_length=250)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='committer_aliases', to='auth.user')),
+            ],
+        ),
+    ]
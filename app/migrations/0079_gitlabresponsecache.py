@@ -0,0 +1,25 @@
+# Generated by Django 4.0 on 2026-10-18 13:41
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0078_process_job_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GitlabResponseCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.TextField(unique=True)),
+                ('etag', models.TextField(blank=True, null=True)),
+                ('last_modified', models.TextField(blank=True, null=True)),
+                ('body', models.JSONField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
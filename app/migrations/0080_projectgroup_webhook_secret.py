@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 13:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0079_gitlabresponsecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='projectgroup',
+            name='webhook_secret',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+    ]
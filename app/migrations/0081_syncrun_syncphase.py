@@ -0,0 +1,49 @@
+# Generated by Django 4.0 on 2026-10-18 13:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0080_projectgroup_webhook_secret'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('O', 'Ongoing'), ('F', 'Finished'), ('E', 'Failed')], default='O', max_length=1)),
+                ('started_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('duration', models.FloatField(default=0)),
+                ('http_calls', models.IntegerField(default=0)),
+                ('retries', models.IntegerField(default=0)),
+                ('bytes_received', models.BigIntegerField(default=0)),
+                ('queries', models.IntegerField(default=0)),
+                ('throttled_seconds', models.FloatField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('process', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sync_runs', to='app.process')),
+                ('repository', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_runs', to='app.repository')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SyncPhase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32)),
+                ('duration', models.FloatField(default=0)),
+                ('http_calls', models.IntegerField(default=0)),
+                ('bytes_received', models.BigIntegerField(default=0)),
+                ('queries', models.IntegerField(default=0)),
+                ('throttled_seconds', models.FloatField(default=0)),
+                ('rows_inserted', models.IntegerField(default=0)),
+                ('rows_updated', models.IntegerField(default=0)),
+                ('rows_unchanged', models.IntegerField(default=0)),
+                ('sync_run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='phases', to='app.syncrun')),
+            ],
+        ),
+    ]
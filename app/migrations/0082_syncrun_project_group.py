@@ -0,0 +1,24 @@
+# Generated by Django 4.0 on 2026-10-18 13:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0081_syncrun_syncphase'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='syncrun',
+            name='project_group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_runs', to='app.projectgroup'),
+        ),
+        migrations.AlterField(
+            model_name='syncrun',
+            name='repository',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sync_runs', to='app.repository'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-18 13:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0082_syncrun_project_group'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issue',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddField(
+            model_name='milestone',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0 on 2026-10-18 14:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0083_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='issue',
+            name='gitlab_total_time_spent',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='checkpoint',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.0 on 2026-10-18 14:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('app', '0084_sync_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GroupSyncToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=1000)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='auth.user')),
+                ('project_group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_tokens', to='app.projectgroup')),
+            ],
+        ),
+    ]
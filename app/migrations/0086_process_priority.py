@@ -0,0 +1,24 @@
+# Generated by Django 4.0 on 2026-10-18 14:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0085_groupsynctoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='process',
+            name='priority',
+            field=models.IntegerField(choices=[(0, 'Interactive'), (1, 'Group'), (2, 'Periodic')], default=1),
+        ),
+        migrations.AddField(
+            model_name='process',
+            name='project_group',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='processes', to='app.projectgroup'),
+        ),
+    ]
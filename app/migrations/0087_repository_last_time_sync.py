@@ -0,0 +1,26 @@
+# Generated by Django 4.0 on 2026-10-18 14:14
+
+import datetime
+from django.db import migrations, models
+
+
+def copy_issue_watermark(apps, schema_editor):
+    # Until now the issue watermark only moved once the time spents were saved, so it holds for them too
+    Repository = apps.get_model('app', 'Repository')
+    Repository.objects.update(last_time_sync=models.F('last_issue_sync'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0086_process_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='last_time_sync',
+            field=models.DateTimeField(default=datetime.datetime(1970, 1, 1, 0, 0)),
+        ),
+        migrations.RunPython(copy_issue_watermark, migrations.RunPython.noop),
+    ]
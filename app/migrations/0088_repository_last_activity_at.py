@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 14:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0087_repository_last_time_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
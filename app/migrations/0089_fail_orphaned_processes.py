@@ -0,0 +1,21 @@
+# Generated by Django 4.0 on 2026-10-18 14:52
+
+from django.db import migrations
+
+
+def fail_orphaned_processes(apps, schema_editor):
+    # Ongoing processes from before the job queue ran in threads that no longer exist and can't be run again without arguments
+    Process = apps.get_model('app', 'Process')
+    Process.objects.filter(status='O').filter(arguments__isnull=True).filter(heartbeat__isnull=True) \
+        .update(status='E', error='Process was interrupted before it could be moved to the job queue')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0088_repository_last_activity_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(fail_orphaned_processes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0 on 2026-10-18 14:46
+
+from django.db import migrations, models
+
+
+def remove_duplicate_notes(apps, schema_editor):
+    # A hook and a sync saving the same note at once stored it twice, which counted the logged time twice
+    TimeSpent = apps.get_model('app', 'TimeSpent')
+    first_rows = TimeSpent.objects.values('gitlab_id').annotate(first=models.Min('pk')).values('first')
+    TimeSpent.objects.exclude(pk__in=first_rows).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0089_fail_orphaned_processes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_notes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='timespent',
+            name='gitlab_id',
+            field=models.IntegerField(unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0 on 2026-10-18 14:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0090_timespent_unique_gitlab_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='last_commit_sha',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.0 on 2026-10-18 14:49
+
+from django.db import migrations, models
+
+
+def remove_duplicate_commits(apps, schema_editor):
+    # Repositories made from the same template synced in parallel could both store the shared history
+    Commit = apps.get_model('app', 'Commit')
+    first_rows = Commit.objects.values('hash').annotate(first=models.Min('pk')).values('first')
+    Commit.objects.exclude(pk__in=first_rows).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0091_repository_last_commit_sha'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_commits, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='commit',
+            name='hash',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
@@ -3,6 +3,7 @@ import random
 
 from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
 
 def identifier_generator():
@@ -25,6 +26,16 @@ class Committer(models.Model):
     account = models.ForeignKey('auth.User', on_delete=models.SET_NULL, null=True, blank=True)
 
 
+class CommitterAlias(models.Model):
+    class AliasKind(models.TextChoices):
+        NAME = ("N", "Name")
+        EMAIL = ("E", "Email")
+
+    kind = models.CharField(max_length=1, choices=AliasKind.choices, default=AliasKind.EMAIL)
+    alias = models.CharField(max_length=250, db_index=True)
+    account = models.ForeignKey('auth.User', on_delete=models.CASCADE, related_name="committer_aliases")
+
+
 class ProjectGroup(models.Model):
     class ChildrenType(models.TextChoices):
         GROUPS = ("G", "Groups")
@@ -36,6 +47,7 @@ class ProjectGroup(models.Model):
     group_id = models.IntegerField(null=True, blank=True)
     parent_group = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True)
     gitlab_token = models.CharField(max_length=1000, null=True, blank=True)
+    webhook_secret = models.CharField(max_length=255, null=True, blank=True)  # Compared with X-Gitlab-Token on incoming hooks
 
     def __str__(self):
         return f"({self.pk}) - {self.name}"
@@ -47,6 +59,13 @@ class ProjectGroupInvitation(models.Model):
     has_been_declined = models.BooleanField(default=False)
 
 
+class GroupSyncToken(models.Model):
+    project_group = models.ForeignKey(ProjectGroup, on_delete=models.CASCADE, related_name="sync_tokens")
+    account = models.ForeignKey('auth.User', on_delete=models.CASCADE)
+    token = models.CharField(max_length=1000)  # Encrypted with the server key, sync workers don't know the admin's password
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
 class Project(models.Model):
     name = models.CharField(max_length=255, null=True, blank=True)
     project_group = models.ForeignKey(ProjectGroup, on_delete=models.SET_NULL, null=True, blank=True)
@@ -61,6 +80,10 @@ class Repository(models.Model):
     name = models.CharField(max_length=255, null=True, blank=True)
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     last_issue_sync = models.DateTimeField(default=datetime.datetime.utcfromtimestamp(0))
+    last_commit_sync = models.DateTimeField(default=datetime.datetime.utcfromtimestamp(0))
+    last_commit_sha = models.CharField(max_length=100, null=True, blank=True)  # Head of the default branch when the last commit sync started
+    last_time_sync = models.DateTimeField(default=datetime.datetime.utcfromtimestamp(0))
+    last_activity_at = models.DateTimeField(null=True, blank=True)  # GitLab's last_activity_at when the last full sync started
 
 
 class UserProject(models.Model):
@@ -151,6 +174,7 @@ class Milestone(models.Model):
     title = models.TextField(null=True, blank=True)
     gitlab_id = models.IntegerField()
     gitlab_link = models.TextField(null=True, blank=True)
+    content_hash = models.CharField(max_length=40, null=True, blank=True)  # Of the GitLab fields last written, see bulk_ingest
 
 
 class Issue(models.Model):
@@ -164,10 +188,13 @@ class Issue(models.Model):
     closed_by = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="issues_closed", null=True, blank=True)
     author = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="issues_authored", null=True, blank=True)
     assignee = models.ForeignKey(User, on_delete=models.SET_NULL, related_name="issues_assigned", null=True, blank=True)
+    total_time_spent = models.IntegerField(null=True, blank=True)  # Seconds, the GitLab total that the saved time spents cover
+    gitlab_total_time_spent = models.IntegerField(null=True, blank=True)  # Seconds, as last seen in GitLab's time_stats
+    content_hash = models.CharField(max_length=40, null=True, blank=True)  # Of the GitLab fields last written, see bulk_ingest
 
 
 class TimeSpent(models.Model):
-    gitlab_id = models.IntegerField()
+    gitlab_id = models.IntegerField(unique=True)
     amount = models.IntegerField()
     time = models.DateTimeField()
     issue = models.ForeignKey(Issue, on_delete=models.CASCADE)
@@ -175,7 +202,7 @@ class TimeSpent(models.Model):
 
 
 class Commit(models.Model):
-    hash = models.CharField(max_length=100)
+    hash = models.CharField(max_length=100, unique=True)
     time = models.DateTimeField()
     message = models.TextField()
     lines_added = models.IntegerField()
@@ -237,8 +264,15 @@ class Process(models.Model):
         SYNC_REPO = ("SR", "Sync repo")
 
     class ProcessStatus(models.TextChoices):
+        QUEUED = ("Q", "Queued")
         ONGOING = ("O", "Ongoing")
         FINISHED = ("F", "Finished")
+        FAILED = ("E", "Failed")
+
+    class SyncPriority(models.IntegerChoices):
+        INTERACTIVE = (0, "Interactive")
+        GROUP = (1, "Group")
+        PERIODIC = (2, "Periodic")
 
     hash = models.TextField()
     id_hash = models.TextField()
@@ -246,3 +280,59 @@ class Process(models.Model):
     status = models.CharField(max_length=1, choices=ProcessStatus.choices)
     completion_percentage = models.DecimalField(max_digits=6, decimal_places=3)
     data = models.JSONField(null=True, blank=True)
+
+    # Background job bookkeeping, used by the sync workers
+    arguments = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    run_after = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    locked_by = models.CharField(max_length=255, null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    checkpoint = models.JSONField(null=True, blank=True)  # Sync progress per repository, a retried attempt resumes from it
+    priority = models.IntegerField(choices=SyncPriority.choices, default=SyncPriority.GROUP)  # Lower values are claimed first
+    project_group = models.ForeignKey(ProjectGroup, on_delete=models.SET_NULL, null=True, blank=True, related_name="processes")  # Queued syncs are shared fairly between project groups
+
+
+class GitlabResponseCache(models.Model):
+    url = models.TextField(unique=True)  # Never contains the token, GitlabClient sends it as a header
+    etag = models.TextField(null=True, blank=True)
+    last_modified = models.TextField(null=True, blank=True)
+    body = models.JSONField(null=True, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+
+class SyncRun(models.Model):
+    class SyncStatus(models.TextChoices):
+        ONGOING = ("O", "Ongoing")
+        FINISHED = ("F", "Finished")
+        FAILED = ("E", "Failed")
+
+    # Runs without a repository are the group level fetches of a group sync
+    repository = models.ForeignKey(Repository, on_delete=models.CASCADE, null=True, blank=True, related_name="sync_runs")
+    project_group = models.ForeignKey(ProjectGroup, on_delete=models.CASCADE, null=True, blank=True, related_name="sync_runs")
+    process = models.ForeignKey(Process, on_delete=models.SET_NULL, null=True, blank=True, related_name="sync_runs")
+    status = models.CharField(max_length=1, choices=SyncStatus.choices, default=SyncStatus.ONGOING)
+    started_at = models.DateTimeField(default=timezone.now, db_index=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    duration = models.FloatField(default=0)  # Seconds
+    http_calls = models.IntegerField(default=0)
+    retries = models.IntegerField(default=0)
+    bytes_received = models.BigIntegerField(default=0)
+    queries = models.IntegerField(default=0)
+    throttled_seconds = models.FloatField(default=0)
+    error = models.TextField(null=True, blank=True)
+
+
+class SyncPhase(models.Model):
+    sync_run = models.ForeignKey(SyncRun, on_delete=models.CASCADE, related_name="phases")
+    name = models.CharField(max_length=32)
+    duration = models.FloatField(default=0)  # Seconds
+    http_calls = models.IntegerField(default=0)
+    bytes_received = models.BigIntegerField(default=0)
+    queries = models.IntegerField(default=0)
+    throttled_seconds = models.FloatField(default=0)
+    rows_inserted = models.IntegerField(default=0)
+    rows_updated = models.IntegerField(default=0)
+    rows_unchanged = models.IntegerField(default=0)
@@ -3,8 +3,11 @@ from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 import base64
+import hashlib
 import os
 
+from django.conf import settings
+
 from .models import UserProjectGroup, UserProject
 
 
@@ -85,3 +88,21 @@ def get_user_token(user, password):
     fernet = Fernet(key)
     token = fernet.decrypt(raw_token)
     return token.decode()
+
+
+def get_server_fernet():
+    key = base64.urlsafe_b64encode(hashlib.sha256(settings.SECRET_KEY.encode()).digest())
+    return Fernet(key)
+
+
+def encrypt_for_server(token):
+    # Used for tokens that background workers need, workers don't know the user's password
+    if token is None:
+        return None
+    return get_server_fernet().encrypt(token.encode()).decode()
+
+
+def decrypt_for_server(encrypted_token):
+    if encrypted_token is None:
+        return None
+    return get_server_fernet().decrypt(encrypted_token.encode()).decode()
@@ -2,7 +2,7 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 
 from .models import ProjectGroup, Profile, Project, Repository, AssessmentCategory, AssessmentMilestone, \
-    UserAssessment, UserProject, Milestone, Process, Feedback, TimeSpent, Issue
+    UserAssessment, UserProject, Milestone, Process, Feedback, TimeSpent, Issue, SyncRun, SyncPhase
 
 
 class ProjectGroupSerializer(serializers.ModelSerializer):
@@ -133,7 +133,22 @@ class MilestoneSerializer(serializers.ModelSerializer):
 class ProcessSerializer(serializers.ModelSerializer):
     class Meta:
         model = Process
-        fields = ['id', 'hash', 'type', 'status', 'completion_percentage', 'data']
+        fields = ['id', 'hash', 'type', 'status', 'completion_percentage', 'data', 'error']
+
+
+class SyncPhaseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SyncPhase
+        fields = ['name', 'duration', 'http_calls', 'bytes_received', 'queries', 'throttled_seconds', 'rows_inserted', 'rows_updated', 'rows_unchanged']
+
+
+class SyncRunSerializer(serializers.ModelSerializer):
+    phases = SyncPhaseSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = SyncRun
+        fields = ['id', 'repository', 'project_group', 'process', 'status', 'started_at', 'finished_at', 'duration', 'http_calls', 'retries', 'bytes_received',
+                  'queries', 'throttled_seconds', 'error', 'phases']
 
 
 class FeedbackSerializer(serializers.ModelSerializer):
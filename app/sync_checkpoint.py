@@ -0,0 +1,38 @@
+import threading
+
+from .models import Process
+
+
+class Checkpoint:
+    # Without a process the state only lives as long as the sync, e.g. for syncs started straight from a view
+    def __init__(self, process=None):
+        self.process = process
+        self.lock = threading.Lock()
+        self.states = dict(process.checkpoint or {}) if process is not None else {}
+
+    def state(self, key):
+        with self.lock:
+            return self.states.setdefault(str(key), {})
+
+    def is_done(self, key, phase):
+        return phase in self.state(key).get("done", [])
+
+    def update(self, key, **values):
+        self.update_many({key: values})
+
+    def update_many(self, values_per_key):
+        with self.lock:
+            for key, values in values_per_key.items():
+                self.states.setdefault(str(key), {}).update(values)
+            self.save()
+
+    def mark_done(self, key, phase, **values):
+        with self.lock:
+            state = self.states.setdefault(str(key), {})
+            state["done"] = state.get("done", []) + [phase]
+            state.update(values)
+            self.save()
+
+    def save(self):
+        if self.process is not None:
+            Process.objects.filter(pk=self.process.pk).update(checkpoint=self.states)
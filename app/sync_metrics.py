@@ -0,0 +1,79 @@
+import time
+
+from contextlib import contextmanager
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import SyncRun, SyncPhase
+
+
+class PhaseMetrics:
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.rows_inserted = 0
+        self.rows_updated = 0
+        self.rows_unchanged = 0
+
+    def add_rows(self, inserted=0, updated=0, unchanged=0):
+        self.rows_inserted += inserted
+        self.rows_updated += updated
+        self.rows_unchanged += unchanged
+
+    def count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class SyncRecorder:
+    # Only counts queries made from the thread that runs the phase, the helper threads of a phase only talk to GitLab
+    def __init__(self, client, process=None, repository=None, project_group=None):
+        self.client = client
+        self.start = time.monotonic()
+        self.start_stats = self.client_stats()
+        self.sync_run = SyncRun.objects.create(repository=repository, project_group=project_group, process=process)
+        self.phases = []
+
+    def client_stats(self):
+        return self.client.request_count, self.client.retry_count, self.client.bytes_received, self.client.throttled_seconds
+
+    @contextmanager
+    def phase(self, name):
+        metrics = PhaseMetrics(name)
+        start = time.monotonic()
+        request_count, _, bytes_received, throttled_seconds = self.client_stats()
+        try:
+            with connection.execute_wrapper(metrics.count_query):
+                yield metrics
+        finally:
+            self.phases.append(SyncPhase(
+                sync_run=self.sync_run,
+                name=name,
+                duration=time.monotonic() - start,
+                http_calls=self.client.request_count - request_count,
+                bytes_received=self.client.bytes_received - bytes_received,
+                queries=metrics.queries,
+                throttled_seconds=self.client.throttled_seconds - throttled_seconds,
+                rows_inserted=metrics.rows_inserted,
+                rows_updated=metrics.rows_updated,
+                rows_unchanged=metrics.rows_unchanged
+            ))
+
+    def finish(self, status="F", error=None):
+        request_count, retry_count, bytes_received, throttled_seconds = self.client_stats()
+        run = self.sync_run
+        run.status = status
+        run.error = error
+        run.finished_at = timezone.now()
+        run.duration = time.monotonic() - self.start
+        run.http_calls = request_count - self.start_stats[0]
+        run.retries = retry_count - self.start_stats[1]
+        run.bytes_received = bytes_received - self.start_stats[2]
+        run.throttled_seconds = throttled_seconds - self.start_stats[3]
+        run.queries = sum(phase.queries for phase in self.phases)
+        run.save()
+        SyncPhase.objects.bulk_create(self.phases)
+        target = f"repo {run.repository_id}" if run.repository_id is not None else f"project group {run.project_group_id}"
+        print(f"Synced {target} in {run.duration:.1f}s with {run.http_calls} GitLab requests, {run.retries} retries and {run.queries} queries")
+        return run
@@ -8,7 +8,8 @@ from .views import ProjectGroupView, ProfileView, ProjectGroupLoadProjectsView,
     ProcessInfoView, AssessmentCategoryRecalculateView, ParametricTimeSpentView, ChangeDevColourView, \
     ProjectRepoConnectionView, RepoSetProjectView, AddNewProject, AddNewRepo, AssessmentCategoryCopyView, \
     ManageGroupInvitationsView, ProfileInvitationView, AcceptGroupInvitationView, ProjectGroupUsersView, \
-    ProjectUsersView, AssessmentCsvView
+    ProjectUsersView, AssessmentCsvView, GitlabWebhookView, RepositorySyncRunsView, ProjectGroupSyncRunsView, \
+    ProjectGroupSyncTokensView
 
 router = routers.DefaultRouter()
 
@@ -29,6 +30,8 @@ urlpatterns = [
 
     path("groups/<int:id>/projects/", ProjectGroupLoadProjectsView.as_view(), name="load_projects"),
     path("groups/<int:id>/update/", ProjectGroupUpdateView.as_view(), name="update_project_group"),
+    path("groups/<int:id>/sync_runs/", ProjectGroupSyncRunsView.as_view(), name="project_group_sync_runs"),
+    path("groups/<int:id>/sync_tokens/", ProjectGroupSyncTokensView.as_view(), name="project_group_sync_tokens"),
 
     path("projects/<int:id>/", RepositoryView.as_view(), name="repos"),
     path("projects/<int:id>/milestone/<int:milestone_id>/", ProjectMilestoneDataView.as_view(), name="project_milestone_data"),
@@ -42,6 +45,7 @@ urlpatterns = [
     path("projects/<int:id>/milestone_connections/", ProjectMilestoneConnectionsView.as_view(), name="project_milestone_connections"),
     path("milestones/<int:id>/assessment_milestone/", MilestoneSetAssessmentMilestoneView.as_view(), name="set_assessment_milestone_for_milestone"),
     path("repositories/<int:id>/update/", RepositoryUpdateView.as_view(), name="update_repository"),
+    path("repositories/<int:id>/sync_runs/", RepositorySyncRunsView.as_view(), name="repository_sync_runs"),
 
     path("projects/<int:id>/assessments/", ProjectAssessmentsView.as_view(), name="project_assessments"),
     path("users/<int:user_id>/assess/<int:assessment_id>/", AssessUserView.as_view(), name="assess_user"),
@@ -52,6 +56,7 @@ urlpatterns = [
     path("invitations/", ProfileInvitationView.as_view(), name="invitations"),
 
     path("process/<int:id>/<str:hash>/", ProcessInfoView.as_view(), name="get_process_info"),
+    path("webhooks/gitlab/", GitlabWebhookView.as_view(), name="gitlab_webhook"),
     path("feedback/", FeedbackView.as_view(), name="feedback"),
     path("", TestLoginView.as_view(), name="test_login"),
 ]
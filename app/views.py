@@ -1,27 +1,29 @@
 import csv
 
-import requests
-import hashlib
-import time
-import threading
 import datetime
 
+from cryptography.fernet import InvalidToken
 from rest_framework import views
 from django.http import JsonResponse, HttpResponse
 from django.contrib.auth.models import User
 from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import Count, Q, Sum
 
 from .models import ProjectGroup, UserProjectGroup, Profile, Project, Repository, AssessmentCategory, \
     AssessmentCalculation, AssessmentMilestone, UserProject, UserAssessment, Milestone, TimeSpent, Feedback, Process, \
-    AutomateAssessment, ProjectGroupInvitation, ProjectAssessment
+    AutomateAssessment, ProjectGroupInvitation, ProjectAssessment, SyncRun, SyncPhase, GroupSyncToken
 
 from .serializers import ProjectGroupSerializer, ProjectSerializer, RepositorySerializer, \
     AssessmentCategorySerializer, AssessmentCategorySerializerWithAssessments, MilestoneSerializer, \
-    AssessmentMilestoneSerializer, ProcessSerializer, FeedbackSerializer
+    AssessmentMilestoneSerializer, ProcessSerializer, FeedbackSerializer, SyncRunSerializer
+
+from .gitlab_client import GitlabClient, GitlabError
 
 from . import assessment_tree
 from . import model_traversal
 from . import gitlab_helper
+from . import job_queue
+from . import webhooks
 from . import helpers
 from . import milestone_logic
 from . import constants
@@ -63,25 +65,17 @@ class ProjectGroupLoadProjectsView(views.APIView):
 
         print(f"Project group is {group} with gitlab group id {group.group_id}")
         profile = Profile.objects.filter(user=request.user).first()
-        print(f"User's provided auth token is {profile.gitlab_token}")
-
-        base_url = "https://gitlab.cs.ttu.ee"
-        api_part = "/api/v4"
-        endpoint_part = f"/groups/{group.group_id}/projects"
-        token_part = f"?private_token={profile.gitlab_token}&per_page=100"
-        # TODO: Theoretically there is a chance that there are more than 100 projects per group
-
-        answer = requests.get(base_url + api_part + endpoint_part + token_part)
-        print(f"Got response")
 
-        json = answer.json()
-        if not isinstance(json, list):
-            error = f"Something went wrong, expected 'json' variable to be a list, but was {type(json)} instead.\n"
-            error += f"'json' value: {json}"
+        client = GitlabClient(profile.gitlab_token)
+        try:
+            json = client.get_all_pages(f"/groups/{group.group_id}/projects")
+        except GitlabError as e:
+            error = f"Something went wrong while loading projects from GitLab: {e}"
             print(error)
             return JsonResponse({"error": error})
+        print(f"Got response")
+
         data = []
-        print(json)
         for project in json:
             data.append({
                 "name": project["name"],
@@ -92,7 +86,7 @@ class ProjectGroupLoadProjectsView(views.APIView):
                 continue
             project_object = Project.objects.create(name=project["name_with_namespace"], project_group=group)
             repo = Repository.objects.create(url=project["web_url"], gitlab_id=project["id"], name=project["name"], project=project_object)
-            members = [member["username"] for member in gitlab_helper.get_members_from_repo(repo, request.user, True)]
+            members = [member["username"] for member in gitlab_helper.get_members_from_repo(repo, request.user, True, profile.gitlab_token, client)]
             for user in User.objects.filter(username__in=members).all():
                 rights_query = UserProjectGroup.objects.filter(account=user).filter(project_group=group)
                 if rights_query.count() > 0 and rights_query.first().rights in ["A", "O"]:
@@ -153,6 +147,8 @@ class ProjectsView(views.APIView):
             group.description = request.data["description"]
         if "gitlab_token" in request.data.keys():
             group.gitlab_token = request.data["gitlab_token"]
+        if "webhook_secret" in request.data.keys():
+            group.webhook_secret = request.data["webhook_secret"]
         group.save()
         return JsonResponse({})
 
@@ -387,8 +383,14 @@ class RepositoryUpdateView(views.APIView):
             return JsonResponse(constants.anonymous_json)
         if not security.user_has_access_to_project(request.user, Repository.objects.filter(pk=id).first().project):
             return JsonResponse(constants.no_access_json)
+        try:
+            phases = gitlab_helper.get_sync_phases(request.data.get("scope"))
+        except ValueError as e:
+            return JsonResponse(constants.error_json(str(e)))
         user_token = security.get_user_token(request.user, request.data["password"])
-        repo = gitlab_helper.update_repository(id, request.user, [], user_token)
+        project_group = Repository.objects.get(pk=id).project.project_group
+        with job_queue.interactive_process("SR", "repo update", id, request.user, project_group) as process:
+            repo = gitlab_helper.update_repository(id, request.user, [], user_token, process, full_commit_sync=request.data.get("full_commit_sync", False), phases=phases)
         return JsonResponse({200: "OK", "data": RepositorySerializer(repo).data})
 
 
@@ -399,27 +401,18 @@ class ProjectGroupUpdateView(views.APIView):
         project_group = ProjectGroup.objects.filter(pk=id).first()
         if not security.user_has_access_to_project_group_with_security_level(request.user, project_group, ["A", "O"]):
             return JsonResponse(constants.no_access_json)
+        try:
+            phases = gitlab_helper.get_sync_phases(request.data.get("scope"))
+        except ValueError as e:
+            return JsonResponse(constants.error_json(str(e)))
         user_token = None
         if "password" in request.data:
             security.encrypt_token(request.user, request.data["password"])
             user_token = security.get_user_token(request.user, request.data["password"])
-        name = "project group update"
-        hid = hashlib.sha256()
-        [hid.update(str(x).encode()) for x in [name, id]]
-        old = Process.objects.filter(id_hash=hid.hexdigest()).filter(status="O")
-        if old.count() > 0:
-            old_p = old.first()
-            return JsonResponse({
-                "id": old_p.pk,
-                "hash": old_p.hash
-            })
-
-        h = hashlib.sha256()
-        [h.update(str(x).encode()) for x in [time.time(), name, id, request.user.pk]]
-        process = Process.objects.create(hash=h.hexdigest(), id_hash=hid.hexdigest(), type="SG", status="O", completion_percentage=0)
-        process.save()
-        t = threading.Thread(target=gitlab_helper.update_all_repos_in_group, args=[project_group, request.user, process, user_token], daemon=True)
-        t.start()
+        arguments = {"project_group": project_group.pk, "full_commit_sync": request.data.get("full_commit_sync", False), "phases": phases, "force": request.data.get("force", False)}
+        # Syncs of different scopes don't stand in for each other when one is already queued
+        name = "project group update" if phases is None else f"project group update of {', '.join(phases)}"
+        process = job_queue.enqueue("SG", name, id, request.user, arguments, user_token, project_group=project_group)
         return JsonResponse({
             "id": process.pk,
             "hash": process.hash
@@ -638,6 +631,91 @@ class ProcessInfoView(views.APIView):
         return JsonResponse({"process": ProcessSerializer(processes.first()).data})
 
 
+def get_sync_run_limit(request):
+    try:
+        return max(1, min(500, int(request.GET.get("limit", 50))))
+    except ValueError:
+        return 50
+
+
+class RepositorySyncRunsView(views.APIView):
+    def get(self, request, id):
+        if request.user.is_anonymous:
+            return JsonResponse(constants.anonymous_json)
+        repo = Repository.objects.filter(pk=id).first()
+        if repo is None:
+            return JsonResponse({"error": f"Repository with id {id} does not exist."}, status=404)
+        if not security.user_has_access_to_project(request.user, repo.project):
+            return JsonResponse(constants.no_access_json)
+        runs = SyncRun.objects.filter(repository=repo).prefetch_related("phases").order_by("-started_at")[:get_sync_run_limit(request)]
+        return JsonResponse({"sync_runs": SyncRunSerializer(runs, many=True).data})
+
+
+class ProjectGroupSyncRunsView(views.APIView):
+    def get(self, request, id):
+        if request.user.is_anonymous:
+            return JsonResponse(constants.anonymous_json)
+        group = ProjectGroup.objects.filter(pk=id).first()
+        if not security.user_has_access_to_project_group_with_security_level(request.user, group, ["A", "O"]):
+            return JsonResponse(constants.no_access_json)
+        runs = SyncRun.objects.filter(Q(repository__project__project_group=group) | Q(project_group=group))
+        if "process" in request.GET:
+            runs = runs.filter(process_id=request.GET["process"])
+        run_ids = list(runs.order_by("-started_at").values_list("pk", flat=True)[:get_sync_run_limit(request)])
+        totals = ["duration", "http_calls", "bytes_received", "queries", "throttled_seconds", "rows_inserted", "rows_updated", "rows_unchanged"]
+        phases = SyncPhase.objects.filter(sync_run__in=run_ids).values("name") \
+            .annotate(**{total: Sum(total) for total in totals}).order_by("-duration")
+        repositories = SyncRun.objects.filter(pk__in=run_ids).values("repository", "repository__name") \
+            .annotate(runs=Count("pk"), duration=Sum("duration"), http_calls=Sum("http_calls"), queries=Sum("queries")).order_by("-duration")
+        runs = SyncRun.objects.filter(pk__in=run_ids).prefetch_related("phases").order_by("-started_at")
+        return JsonResponse({
+            "phases": list(phases),
+            "repositories": list(repositories),
+            "sync_runs": SyncRunSerializer(runs, many=True).data
+        })
+
+
+class ProjectGroupSyncTokensView(views.APIView):
+    def get(self, request, id):
+        if request.user.is_anonymous:
+            return JsonResponse(constants.anonymous_json)
+        group = ProjectGroup.objects.filter(pk=id).first()
+        if not security.user_has_access_to_project_group_with_security_level(request.user, group, ["A", "O"]):
+            return JsonResponse(constants.no_access_json)
+        sync_tokens = GroupSyncToken.objects.filter(project_group=group).select_related("account").order_by("pk")
+        return JsonResponse(constants.successful_data_json("Successfully fetched sync tokens", {
+            "group_token": group.gitlab_token is not None,
+            "sync_tokens": [{"account": {"id": sync_token.account.pk, "username": sync_token.account.username}, "created_at": sync_token.created_at} for sync_token in sync_tokens]
+        }))
+
+    def post(self, request, id):
+        if request.user.is_anonymous:
+            return JsonResponse(constants.anonymous_json)
+        group = ProjectGroup.objects.filter(pk=id).first()
+        if not security.user_has_access_to_project_group_with_security_level(request.user, group, ["A", "O"]):
+            return JsonResponse(constants.no_access_json)
+        if "password" not in request.data:
+            return JsonResponse(constants.error_json("Your password is needed to decrypt your GitLab token"))
+        try:
+            user_token = security.get_user_token(request.user, request.data["password"])
+        except InvalidToken:
+            return JsonResponse(constants.error_json("Wrong password"))
+        if user_token is None:
+            return JsonResponse(constants.error_json("Your profile has no GitLab token"))
+        GroupSyncToken.objects.update_or_create(project_group=group, account=request.user, defaults={"token": security.encrypt_for_server(user_token)})
+        return JsonResponse(constants.successful_empty_json("Your GitLab token is now also used to sync this project group"))
+
+    def delete(self, request, id):
+        if request.user.is_anonymous:
+            return JsonResponse(constants.anonymous_json)
+        group = ProjectGroup.objects.filter(pk=id).first()
+        account_id = request.data.get("id", request.user.pk)
+        if account_id != request.user.pk and not security.user_has_access_to_project_group_with_security_level(request.user, group, ["A", "O"]):
+            return JsonResponse(constants.no_access_json)
+        GroupSyncToken.objects.filter(project_group=group).filter(account_id=account_id).delete()
+        return JsonResponse(constants.successful_empty_json("Successfully removed sync token"))
+
+
 class AssessmentCategoryRecalculateView(views.APIView):
     def get(self, request, id):
         assessment_category = AssessmentCategory.objects.filter(pk=id).first()
@@ -714,24 +792,9 @@ class AddNewRepo(views.APIView):
         if not security.user_has_access_to_project(request.user, project):
             return JsonResponse(constants.no_access_json)
         repo = Repository.objects.create(url=request.data["url"], gitlab_id=request.data["gitlab_id"], name=request.data["name"], project=project)
-        name = "repo update"
-        hid = hashlib.sha256()
-        [hid.update(str(x).encode()) for x in [name, id]]
-        old = Process.objects.filter(id_hash=hid.hexdigest()).filter(status="O")
-        if old.count() > 0:
-            old_p = old.first()
-            return JsonResponse({
-                "id": old_p.pk,
-                "hash": old_p.hash
-            })
-        h = hashlib.sha256()
-        [h.update(str(x).encode()) for x in [time.time(), name, id, request.user.pk]]
-        process = Process.objects.create(hash=h.hexdigest(), id_hash=hid.hexdigest(), type="SR", status="O", completion_percentage=0)
-
         user_token = security.get_user_token(request.user, request.data["password"])
-
-        t = threading.Thread(target=gitlab_helper.update_repository, args=[repo.pk, request.user, [], user_token, process], daemon=True)
-        t.start()
+        process = job_queue.enqueue("SR", "repo update", repo.pk, request.user, {"repository": repo.pk}, user_token,
+                                    Process.SyncPriority.INTERACTIVE, project.project_group)
         return JsonResponse({
             "id": process.pk,
             "hash": process.hash
@@ -948,3 +1011,16 @@ class AssessmentCsvView(views.APIView):
                     # print(f"Options were {assessment_types} and chose {highest_priority_assessment.assessment_type}")
                 writer.writerow([str(x) for x in row])
         return response
+
+
+class GitlabWebhookView(views.APIView):
+    authentication_classes = []
+    permission_classes = []
+
+    def post(self, request):
+        repo = webhooks.get_repository(request.data)
+        if repo is None or not webhooks.is_valid_token(repo, request.headers.get("X-Gitlab-Token")):
+            return JsonResponse(constants.error_json("Unknown repository or invalid webhook token"), status=401)
+        message = webhooks.handle_event(repo, request.data)
+        print(f"GitLab webhook for repo {repo.pk}: {message}")
+        return JsonResponse(constants.successful_empty_json(message))
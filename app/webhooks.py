@@ -0,0 +1,108 @@
+import hmac
+
+from .models import Repository, Issue
+
+from . import bulk_ingest
+from . import gitlab_helper
+from . import job_queue
+
+
+def get_repository(payload):
+    project_id = payload.get("project", {}).get("id", payload.get("project_id"))
+    if project_id is None:
+        return None
+    return Repository.objects.filter(gitlab_id=project_id).first()
+
+
+def is_valid_token(repo, token):
+    project_group = repo.project.project_group
+    if project_group is None or not project_group.webhook_secret or token is None:
+        return False
+    return hmac.compare_digest(project_group.webhook_secret.encode(), token.encode())
+
+
+def has_sync_token(repo):
+    project_group = repo.project.project_group
+    return project_group is not None and (project_group.gitlab_token is not None or project_group.sync_tokens.exists())
+
+
+def enqueue_sync(repo, phases):
+    # GitLab gives up on a hook after about 10 seconds, so anything that needs its API runs in a sync worker
+    arguments = {"repository": repo.pk, "phases": phases}
+    return job_queue.enqueue("SR", f"repo update of {', '.join(phases)}", repo.pk, None, arguments, project_group=repo.project.project_group)
+
+
+def parse_gitlab_time(value):
+    # Older hook payloads use "2022-05-17 18:08:09 UTC" instead of ISO 8601
+    if value is not None and value.endswith(" UTC"):
+        return value[:-4] + "+00:00"
+    return value
+
+
+def issue_from_attributes(attributes, payload):
+    assignees = payload.get("assignees") or []
+    return {
+        "id": attributes["id"],
+        "iid": attributes["iid"],
+        "title": attributes.get("title"),
+        "milestone": {"id": attributes["milestone_id"]} if attributes.get("milestone_id") is not None else None,
+        "web_url": attributes.get("url"),
+        "closed_by": payload.get("user") if attributes.get("action") == "close" else None,
+        "author": None,
+        "assignee": assignees[0] if len(assignees) > 0 else None,
+        "time_stats": {"total_time_spent": attributes["total_time_spent"]} if attributes.get("total_time_spent") is not None else None
+    }
+
+
+def handle_push(repo, payload):
+    default_branch = payload.get("project", {}).get("default_branch")
+    if default_branch is not None and payload.get("ref") != f"refs/heads/{default_branch}":
+        return "Ignored push to a branch other than the default branch"
+    if not has_sync_token(repo):
+        return "Project group has no GitLab token, commits will be loaded by the next sync"
+    # Hook payloads don't carry line stats, so the commits are listed with them by a queued commit sync
+    if len(bulk_ingest.get_new_commits(repo, payload.get("commits", []))) == 0 and payload.get("total_commits_count", 0) <= len(payload.get("commits", [])):
+        return "No new commits"
+    process = enqueue_sync(repo, ["commits"])
+    return f"Queued commit sync in process {process.pk}"
+
+
+def handle_issue(repo, payload):
+    issue = issue_from_attributes(payload["object_attributes"], payload)
+    issues_to_refresh = bulk_ingest.ingest_issues(repo, [issue])
+    # Time logged with /spend only shows up as a changed total, system notes don't trigger note hooks
+    if any(total_time_spent is not None for _, _, total_time_spent in issues_to_refresh) and has_sync_token(repo):
+        process = enqueue_sync(repo, ["time_spent"])
+        return f"Updated issue {issue['iid']}, queued its time spent in process {process.pk}"
+    return f"Updated issue {issue['iid']}"
+
+
+def handle_note(repo, payload):
+    attributes = payload["object_attributes"]
+    if attributes.get("noteable_type") != "Issue" or "issue" not in payload:
+        return "Ignored note that isn't on an issue"
+    issue = payload["issue"]
+    if not Issue.objects.filter(gitlab_id=issue["id"]).exists():
+        bulk_ingest.ingest_issues(repo, [issue_from_attributes(issue, {})])
+    note = {
+        "id": attributes["id"],
+        "body": attributes["note"],
+        "author": {"username": payload["user"]["username"]},
+        "created_at": parse_gitlab_time(attributes["created_at"])
+    }
+    added = gitlab_helper.save_time_spents(repo, [(issue["id"], note)], [])
+    return f"Added {added} time spent entries"
+
+
+event_handlers = {
+    "push": handle_push,
+    "issue": handle_issue,
+    "note": handle_note
+}
+
+
+def handle_event(repo, payload):
+    handler = event_handlers.get(payload.get("object_kind"))
+    if handler is None:
+        return f"Ignored {payload.get('object_kind')} event"
+    return handler(repo, payload)
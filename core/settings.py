@@ -173,3 +173,36 @@ GRAPH_MODELS = {
   'all_applications': True,
   'group_models': True,
 }
+
+# Amount of parallel requests used when fetching issue notes during a repository sync
+GITLAB_NOTES_FETCH_WORKERS = 8
+
+# GitLab API client
+GITLAB_URL = "https://gitlab.cs.ttu.ee"
+GITLAB_REQUEST_TIMEOUT = 30  # Seconds
+GITLAB_POOL_SIZE = 32  # Keep-alive connections kept open to GitLab
+GITLAB_PAGE_FETCH_WORKERS = 8  # Parallel page requests when GitLab reports X-Total-Pages
+GITLAB_PREFETCH_PAGES = 4  # Pages fetched ahead of the one being written, bounds the memory a sync uses
+# Incremental commit syncs also look this far behind the watermark to catch commits that were pushed late
+GITLAB_COMMIT_SYNC_OVERLAP_HOURS = 24
+# First imports with at least this many commits are written with PostgreSQL COPY instead of bulk_create
+COMMIT_COPY_THRESHOLD = 5000
+
+# Background sync workers (python manage.py sync_worker)
+SYNC_WORKER_POLL_INTERVAL = 2  # Seconds
+SYNC_JOB_HEARTBEAT_INTERVAL = 15  # Seconds
+SYNC_JOB_STALE_AFTER = 120  # Seconds without a heartbeat before a running process is retried
+SYNC_JOB_RETRY_DELAY = 30  # Seconds, doubled on every further attempt
+SYNC_JOB_MAX_ATTEMPTS = 3
+GROUP_SYNC_WORKERS = 4  # Repositories synced in parallel during a group sync
+SYNC_MAX_RUNNING_JOBS = 4  # Background syncs running at once over all workers, interactive syncs don't count
+SYNC_WORKER_SLOTS = 2  # Syncs one worker runs at once, its last free slot only takes interactive syncs
+SYNC_YIELD_MAX_WAIT = 60  # Seconds a group sync holds back its next repository while interactive syncs run
+SYNC_YIELD_POLL_INTERVAL = 1  # Seconds
+SYNC_INACTIVE_RECHECK_DAYS = 7  # Group syncs skip the issues and commits of repositories without GitLab activity, but not for longer than this
+GITLAB_ACTIVITY_UPDATE_INTERVAL = 3600  # Seconds, GitLab only moves a project's last_activity_at again once it is at least this old
+GITLAB_MAX_CONCURRENCY = 16  # Upper bound of parallel requests per token, lowered automatically when GitLab throttles
+GITLAB_RATE_LIMIT_SLOWDOWN_FRACTION = 0.1  # Lower concurrency once RateLimit-Remaining drops under this share of RateLimit-Limit
+GITLAB_MAX_RETRIES = 5  # Retries for 429, 5xx and connection errors
+GITLAB_BACKOFF_BASE = 1  # Seconds, doubled on every retry when GitLab doesn't send Retry-After
+GITLAB_BACKOFF_MAX = 60  # Seconds